@@ -0,0 +1,117 @@
+import os
+from typing import Optional
+
+import pandas as pd
+
+MAX_OVERHEAD = 10.0
+
+
+def current_rss() -> Optional[int]:
+    """
+    Returns:
+        Optional[int]: The resident set size of this process in bytes,
+            or None if it can't be read (i.e. not on Linux).
+    """
+    try:
+        with open("/proc/self/statm") as r:
+            return int(r.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class AdaptiveBatcher:
+    """
+    Sizes batches so that each one takes up about memory_budget bytes,
+    for stages that would otherwise need a hand-tuned batch_size. The
+    first batch is a small probe used to measure how much memory a row
+    takes up; every batch after that is sized from the running estimate.
+    The estimate is scaled up if the process' RSS grows by more than the
+    batches should account for (e.g. because a stage makes copies of
+    each batch), and relaxed again as that stops happening.
+
+    Args:
+        memory_budget (int): The target memory use of one batch, in
+            bytes.
+        initial (int): The size of the first batch. Default is 1,000.
+        min_size (int): The smallest batch to return. Default is 100.
+        max_size (Optional[int], optional): The largest batch to return.
+            Defaults to None, which means no limit.
+        max_growth (float): The most a batch may grow relative to the
+            previous one. Default is 4.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        initial: int = 1000,
+        min_size: int = 100,
+        max_size: Optional[int] = None,
+        max_growth: float = 4.0,
+    ):
+        self.memory_budget = memory_budget
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_growth = max_growth
+        self.row_bytes: Optional[float] = None
+        # How much more memory the process uses per batch than the
+        # batch's DataFrame does.
+        self.overhead = 1.0
+        self._size = self._clamp(initial)
+        self._rss = current_rss()
+
+    def _clamp(self, size: float) -> int:
+        size = max(int(size), self.min_size)
+        if self.max_size is not None:
+            size = min(size, self.max_size)
+        return size
+
+    def next_size(self) -> int:
+        """
+        Returns:
+            int: The # of rows to put in the next batch.
+        """
+        return self._size
+
+    def observe(self, df: pd.DataFrame) -> None:
+        """
+        Updates the estimates with a batch that has just been processed,
+        and sizes the next batch accordingly.
+
+        Args:
+            df (DataFrame): The batch, as it was read in.
+        """
+        if not len(df):
+            return
+        df_bytes = df.memory_usage(index=True, deep=True).sum()
+        row_bytes = df_bytes / len(df)
+        if self.row_bytes is None:
+            self.row_bytes = row_bytes
+        else:
+            self.row_bytes = 0.5 * self.row_bytes + 0.5 * row_bytes
+        rss = current_rss()
+        if rss is not None and self._rss is not None:
+            # Capped, so that one-off allocations (e.g. caches filling up
+            # on the first batch) can't shrink the batches to nothing.
+            drift = min((rss - self._rss) / df_bytes, MAX_OVERHEAD)
+            if drift > self.overhead:
+                self.overhead = drift
+            else:
+                self.overhead = max(1.0, 0.9 * self.overhead + 0.1 * drift)
+            self._rss = rss
+        size = self.memory_budget / (self.row_bytes * self.overhead)
+        self._size = self._clamp(min(size, self._size * self.max_growth))
+
+
+def batcher_from_mb(memory_budget: Optional[float], **kwargs):
+    """
+    Args:
+        memory_budget (Optional[float]): A memory budget in megabytes,
+            e.g. the --memory_budget command line option.
+        **kwargs: Passed to AdaptiveBatcher.
+    Returns:
+        Optional[AdaptiveBatcher]: An AdaptiveBatcher for the budget, or
+            None if memory_budget is None.
+    """
+    if memory_budget is None:
+        return None
+    return AdaptiveBatcher(int(memory_budget * 1024**2), **kwargs)
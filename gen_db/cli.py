@@ -0,0 +1,482 @@
+"""
+The single entry point for building the simulated database and running
+the vanguard services against it:
+
+    python -m gen_db <command> [options]
+
+Commands import their heavy dependencies (pandas, sqlalchemy, kafka,
+etc.) only when they run, so --help and quick commands start fast. Keep
+this module's top-level imports to the standard library.
+"""
+
+import argparse
+import os
+from pathlib import Path
+from typing import List, Optional
+
+from vanguard.db import constants
+
+
+def add_source_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--raw_file",
+        "-r",
+        help="The name of the file in datastore/raw_data to build from. "
+        "Default is the first file in raw_data (alphabetically).",
+    )
+    parser.add_argument(
+        "--manual_header",
+        "-m",
+        help="The name of a csv file in datastore/templates to pull the "
+        "header from. Useful if your raw data file has no header row.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        type=int,
+        default=100000,
+        help="The batch size for various steps of the data preparation "
+        "stage. Default is 100,000",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        help="If passed, the batch size for the prep, call generation and "
+        "training data steps is worked out as they run, so that each "
+        "batch uses about this many MB of memory. Overrides "
+        "--batch_size for those steps.",
+    )
+
+
+def add_build_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=2,
+        help="The maximum # of independent steps to run at once. Steps "
+        "that write to the same database are never run at the same "
+        "time. Default is 2.",
+    )
+    parser.add_argument(
+        "--num_samples",
+        "-n",
+        type=int,
+        help="The # of call/census samples to generate. Default is "
+        "the # of records in the voter/cenblocks table.",
+    )
+    parser.add_argument(
+        "--pos_resp_rate",
+        "-p",
+        type=float,
+        default=0.1,
+        help="The percentage of call samples to be generated as positive "
+        "responses. Default is 0.1.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="A seed for the simulated call responses, to make them "
+        "reproducible. Default is no seed.",
+    )
+    parser.add_argument(
+        "--use_ratings",
+        action="store_true",
+        help="If passed, each voter's chance of a positive simulated call "
+        "response is weighted by their census block's rating in "
+        "cenblock_ratings and whether they are a donor, instead of "
+        "every voter having the same chance.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["sqlite", "duckdb"],
+        default="sqlite",
+        help="The engine to run the census block aggregation and training "
+        "data export with. duckdb is an embedded columnar engine that "
+        "is much faster on large states, but must be installed "
+        "separately. Default is sqlite.",
+    )
+    parser.add_argument(
+        "--shards",
+        "-s",
+        type=int,
+        default=0,
+        help="If passed, split voters, calls and census blocks by county "
+        "across this many SQLite files in datastore/sim_db/shards, "
+        "each built in its own process. Default is 0 (not sharded).",
+    )
+    parser.add_argument(
+        "--prep_aggregates",
+        "-a",
+        action="store_true",
+        help="If passed, the census blocks (cenblocks) table is built up "
+        "while the raw data is prepped, instead of by a second full "
+        "pass over the prepped data.",
+    )
+    parser.add_argument(
+        "--normalized",
+        action="store_true",
+        help="If passed, voters are stored with repeated strings "
+        "dictionary-encoded and raw donation strings in a side table, "
+        "behind a voters view that decodes them. Makes the database "
+        "much smaller and voter scans much faster.",
+    )
+
+
+def add_injection_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to delay each model response by. Default is 0.",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Up to this many more seconds are added to each response's "
+        "delay, at random. Default is 0.",
+    )
+
+
+def build_pipeline(args: argparse.Namespace, recreate: bool = False):
+    from . import create
+    import sqlalchemy as sa
+
+    raw_file = args.raw_file
+    if not raw_file:
+        raw_file = sorted(os.listdir(constants.RAW))[0]
+    create.setup_dirs(recreate)
+    engine = sa.create_engine(
+        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
+    )
+    return create.build_pipeline(
+        Path(raw_file),
+        engine,
+        batch_size=args.batch_size,
+        num_samples=args.num_samples,
+        pos_resp_rate=args.pos_resp_rate,
+        manual_header=args.manual_header,
+        max_workers=args.workers,
+        backend=args.backend,
+        n_shards=args.shards,
+        prep_aggregates=args.prep_aggregates,
+        normalized=args.normalized,
+        seed=args.seed,
+        use_ratings=args.use_ratings,
+        memory_budget=args.memory_budget,
+    )
+
+
+def run_create(args: argparse.Namespace):
+    from .create import recreate_stages
+
+    p = build_pipeline(args, recreate=args.recreate == "all")
+    if args.recreate == "auto":
+        p.run()
+    else:
+        stages = recreate_stages(args.recreate, args.shards, args.prep_aggregates)
+        if stages:
+            p.run(force=stages, only=stages)
+
+
+def run_stages(args: argparse.Namespace):
+    from .create import recreate_stages
+
+    if args.command == "prep":
+        stages = ["prep"]
+    else:
+        recreate = dict(build="db", calls="call", train="train")[args.command]
+        stages = recreate_stages(recreate, args.shards, args.prep_aggregates)
+    p = build_pipeline(args)
+    if args.auto:
+        p.run(only=stages)
+    else:
+        p.run(force=stages, only=stages)
+
+
+def run_stream(args: argparse.Namespace):
+    from vanguard.db import util as u
+    from vanguard.run_callcenter import stream_calls, stream_simulated_calls
+
+    db = u.connect_to_sim_db()
+    try:
+        if args.simulate:
+            stream_simulated_calls(
+                db,
+                args.batch_size,
+                args.secs_btw,
+                persist=args.persist,
+                pos_resp_rate=args.pos_resp_rate,
+                num_samples=args.num_samples,
+                seed=args.seed,
+                use_ratings=args.use_ratings,
+            )
+        else:
+            stream_calls(db, args.batch_size, args.secs_btw)
+    finally:
+        db.close()
+
+
+def run_rate(args: argparse.Namespace):
+    import sqlalchemy as sa
+    from vanguard.db import util as u
+    from vanguard.apply.cenblocks import rate_cenblocks
+
+    engine = sa.create_engine(
+        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
+    )
+    session = u.connect_to_sim_db(engine)
+    try:
+        if not rate_cenblocks(session, args.url):
+            raise SystemExit(1)
+    finally:
+        session.close()
+
+
+def run_score(args: argparse.Namespace):
+    from vanguard.apply.prospects import consume_calls
+
+    consume_calls(
+        output=args.output,
+        to_table=args.to_table,
+        window=args.window,
+        max_batch=args.max_batch,
+        url=args.url,
+    )
+
+
+def run_serve(args: argparse.Namespace):
+    from vanguard.apply.serving import serve
+
+    model_paths = dict()
+    for m in args.model or ["cenblocks"]:
+        name, _, path = m.partition("=")
+        model_paths[name] = Path(path) if path else None
+    serve(
+        model_paths,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def run_benchmark(args: argparse.Namespace):
+    from vanguard.apply.serving import LinearModel, benchmark_rating
+
+    r = benchmark_rating(
+        n_blocks=args.blocks,
+        repeats=args.repeats,
+        model=LinearModel.load(args.weights) if args.weights else None,
+        latency=args.latency,
+        jitter=args.jitter,
+    )
+    print(
+        f"Rated {args.blocks} census blocks in {r['best']:.3f}s at best "
+        f"({r['median']:.3f}s median), {r['blocks_per_sec']:,.0f} blocks/s."
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Returns:
+        ArgumentParser: The parser for every command. Each command's
+            parser sets func, the function to run it with.
+    """
+    parser = argparse.ArgumentParser(
+        "gen_db",
+        description="Create a simulated database from the target raw_data and "
+        "run the vanguard services against it.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser(
+        "create",
+        help="Run the whole database creation pipeline (the same as "
+        "python -m gen_db.create).",
+    )
+    add_source_args(create)
+    add_build_args(create)
+    create.add_argument(
+        "--recreate",
+        "-c",
+        default="n",
+        help="Determines what parts, if any, of the simulated database "
+        "to create from scratch ("
+        "db=Build out the database, "
+        "call=Re-generate the call data, "
+        "train=Re-prep the training data, "
+        "all=Recreate everything, "
+        "auto=Re-run only the steps whose inputs have changed since "
+        "the last run, "
+        "n=Do not re-create anything (this is the default)).",
+    )
+    create.set_defaults(func=run_create)
+
+    for name, help in [
+        ("prep", "Prep the raw data into the simulated database."),
+        ("build", "Create the tables and populate them from the prepped data."),
+        ("calls", "Re-generate the simulated call data."),
+        ("train", "Re-prep the census block rating training data."),
+    ]:
+        p = commands.add_parser(name, help=help)
+        add_source_args(p)
+        add_build_args(p)
+        p.add_argument(
+            "--auto",
+            action="store_true",
+            help="If passed, the step is only re-run if its inputs have "
+            "changed since the last run.",
+        )
+        p.set_defaults(func=run_stages)
+
+    stream = commands.add_parser(
+        "stream", help="Stream the simulated calls to the kafka server."
+    )
+    stream.add_argument(
+        "--batch_size",
+        "-b",
+        type=int,
+        default=10000,
+        help="The # of calls to send at a time. Default is 10,000.",
+    )
+    stream.add_argument(
+        "--secs_btw",
+        type=float,
+        default=2,
+        help="The # of seconds to wait between batches. Default is 2.",
+    )
+    stream.add_argument(
+        "--simulate",
+        action="store_true",
+        help="If passed, calls are simulated from the voters table as they "
+        "are streamed, instead of being read from the calls table, so the "
+        "calls table doesn't need to be generated first.",
+    )
+    stream.add_argument(
+        "--persist",
+        action="store_true",
+        help="With --simulate, also add the streamed calls to the calls table.",
+    )
+    stream.add_argument(
+        "--num_samples",
+        "-n",
+        type=int,
+        help="With --simulate, the # of calls to stream. Default is one per voter.",
+    )
+    stream.add_argument(
+        "--pos_resp_rate",
+        "-p",
+        type=float,
+        default=0.1,
+        help="With --simulate, the percentage of calls to be positive "
+        "responses. Default is 0.1.",
+    )
+    stream.add_argument(
+        "--seed",
+        type=int,
+        help="With --simulate, a seed for the call responses. Default is no seed.",
+    )
+    stream.add_argument(
+        "--use_ratings",
+        action="store_true",
+        help="With --simulate, weight each voter's chance of a positive "
+        "response by their census block's rating and whether they are a "
+        "donor.",
+    )
+    stream.set_defaults(func=run_stream)
+
+    rate = commands.add_parser(
+        "rate", help="Rate every census block with the served cenblocks model."
+    )
+    rate.add_argument(
+        "--url",
+        default="http://localhost:8501/v1/models/cenblocks:regress",
+        help="The cenblocks model's regress endpoint. Default is the local "
+        "TF Serving container.",
+    )
+    rate.set_defaults(func=run_rate)
+
+    score = commands.add_parser(
+        "score",
+        help="Score the voters in incoming calls with the served prospects "
+        "model as the calls arrive.",
+    )
+    score.add_argument(
+        "--output",
+        default="prospect_scores",
+        help="The kafka topic to publish scores to. Default is prospect_scores.",
+    )
+    score.add_argument(
+        "--to_table",
+        action="store_true",
+        help="If passed, scores are written to the prospect_scores table "
+        "instead of a kafka topic.",
+    )
+    score.add_argument(
+        "--window",
+        type=float,
+        default=0.05,
+        help="The most time, in seconds, to wait for more calls before "
+        "scoring a batch. Default is 0.05.",
+    )
+    score.add_argument(
+        "--max_batch",
+        type=int,
+        default=500,
+        help="The most calls to score in one request. Default is 500.",
+    )
+    score.add_argument(
+        "--url",
+        default="http://localhost:8501/v1/models/prospects:regress",
+        help="The prospects model's regress endpoint. Default is the local "
+        "TF Serving container.",
+    )
+    score.set_defaults(func=run_score)
+
+    serve = commands.add_parser(
+        "serve",
+        help="Serve linear models over the TF Serving REST regress API, as a "
+        "local stand-in for the TF Serving container.",
+    )
+    serve.add_argument(
+        "--model",
+        action="append",
+        help="A model to serve, as name=path, where path is a .json or .npz "
+        "weights file. A name without a path gets random weights for the "
+        "cenblocks features. May be passed more than once. Default is "
+        "cenblocks with random weights.",
+    )
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8501)
+    add_injection_args(serve)
+    serve.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="The share of requests to fail with a 503. Default is 0.",
+    )
+    serve.add_argument("--seed", type=int)
+    serve.set_defaults(func=run_serve)
+
+    benchmark = commands.add_parser(
+        "benchmark",
+        help="Measure census block rating throughput against a local stand-in "
+        "for the TF Serving container.",
+    )
+    benchmark.add_argument("--blocks", type=int, default=10000)
+    benchmark.add_argument("--repeats", type=int, default=3)
+    benchmark.add_argument(
+        "--weights", help="A .json or .npz cenblocks model weights file."
+    )
+    add_injection_args(benchmark)
+    benchmark.set_defaults(func=run_benchmark)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
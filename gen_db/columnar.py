@@ -0,0 +1,153 @@
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from vanguard.db import constants
+from vanguard.db.models import CensusBlock
+from . import lib
+
+
+def connect(threads: Optional[int] = None):
+    """
+    Opens an in-memory DuckDB connection. DuckDB is an optional
+    dependency of gen_db, only needed for the duckdb backend.
+
+    Args:
+        threads (Optional[int], optional): The # of threads DuckDB may
+            use. Defaults to None, which lets DuckDB use every core.
+    Returns:
+        DuckDBPyConnection: The DuckDB connection.
+    """
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError(
+            "The duckdb backend requires the duckdb package. Install it "
+            "with `pip install duckdb`."
+        ) from e
+    con = duckdb.connect()
+    if threads:
+        con.execute(f"SET threads TO {int(threads)}")
+    return con
+
+
+def load_sqlite_table(
+    con, table: str, db: Path = None, batch_size: int = 250000
+) -> str:
+    """
+    Makes a table in a SQLite database available to a DuckDB
+    connection. If DuckDB's sqlite extension is available the database
+    is attached and read directly, otherwise the table is streamed into
+    DuckDB in batches of batch_size rows.
+
+    Args:
+        con (DuckDBPyConnection): The DuckDB connection.
+        table (str): The name of the SQLite table.
+        db (Path, optional): The SQLite database file. Defaults to
+            None, which uses the simulated database.
+        batch_size (int): The # of rows to stream at a time if the
+            sqlite extension is unavailable. Default is 250,000.
+    Returns:
+        str: The name to use for the table in DuckDB queries.
+    """
+    import duckdb
+
+    db = db or constants.SIMDB
+    try:
+        con.execute("INSTALL sqlite")
+        con.execute("LOAD sqlite")
+        con.execute(f"ATTACH '{db}' AS sim (TYPE SQLITE, READ_ONLY)")
+        return f"sim.{table}"
+    except duckdb.Error:
+        pass
+    conn = sqlite3.connect(db)
+    try:
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+        q = f"SELECT * FROM {table}"
+        for i, df in enumerate(pd.read_sql(q, conn, chunksize=batch_size)):
+            con.register("chunk", df)
+            if i == 0:
+                con.execute(f"CREATE TABLE {table} AS SELECT * FROM chunk")
+            else:
+                con.execute(f"INSERT INTO {table} SELECT * FROM chunk")
+            con.unregister("chunk")
+    finally:
+        conn.close()
+    return table
+
+
+def populate_cenblocks(
+    source_table: str,
+    db: Path = None,
+    threads: Optional[int] = None,
+    batch_size: int = 250000,
+) -> int:
+    """
+    Aggregates the prepped raw data table into census blocks with
+    DuckDB and appends the results to the cenblocks table of the SQLite
+    database. Equivalent to running lib.gen_populate_cenblocks in
+    SQLite.
+
+    Args:
+        source_table (str): The name of the prepped raw data table.
+        db (Path, optional): The SQLite database file. Defaults to
+            None, which uses the simulated database.
+        threads (Optional[int], optional): The # of threads DuckDB may
+            use. Defaults to None, which uses every core.
+        batch_size (int): See load_sqlite_table.
+    Returns:
+        int: The # of census blocks written.
+    """
+    db = db or constants.SIMDB
+    con = connect(threads)
+    try:
+        src = load_sqlite_table(con, source_table, db, batch_size)
+        df = con.execute(lib.gen_select_cenblocks(src)).df()
+    finally:
+        con.close()
+    conn = sqlite3.connect(db)
+    try:
+        df.to_sql(CensusBlock.__tablename__, conn, if_exists="append", index=False)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(df)
+
+
+def export_cenblock_training_data(
+    num_samples: Optional[int] = None,
+    db: Path = None,
+    threads: Optional[int] = None,
+    batch_size: int = 250000,
+) -> None:
+    """
+    Writes the census block rating training data to
+    batch_train/cenblocks.csv with DuckDB. Produces the same file as
+    lib.prep_cenblock_training_data.
+
+    Args:
+        num_samples (Optional[int], optional): The maximum # of census
+            blocks to export. Defaults to None, which exports them all.
+        db (Path, optional): The SQLite database file. Defaults to
+            None, which uses the simulated database.
+        threads (Optional[int], optional): The # of threads DuckDB may
+            use. Defaults to None, which uses every core.
+        batch_size (int): See load_sqlite_table.
+    """
+    cols = [
+        c
+        for c in CensusBlock.gen_column_list()
+        if c not in ("id", "blockgeoid", "total_donors")
+    ]
+    cols.append("CAST(total_donors AS DOUBLE) / totalpop AS donor_pct")
+    con = connect(threads)
+    try:
+        src = load_sqlite_table(con, CensusBlock.__tablename__, db, batch_size)
+        limit = f" LIMIT {int(num_samples)}" if num_samples is not None else ""
+        q = f"SELECT {', '.join(cols)} FROM {src} ORDER BY id{limit}"
+        p = constants.TRAIN.joinpath("cenblocks.csv")
+        con.execute(f"COPY ({q}) TO '{p}' (HEADER, DELIMITER ',')")
+    finally:
+        con.close()
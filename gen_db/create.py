@@ -1,16 +1,18 @@
-import os
-import argparse
+import math
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import List
 import sqlite3
 
 import sqlalchemy as sa
 from sqlalchemy.engine import Engine
 import pandas as pd
 
-from .prepdata import PrepData
-from vanguard.db import models, util as u, constants
-from . import lib
+from .prepdata import PrepData, CENBLOCK_AGGS
+from .pipeline import Pipeline, Stage, FileResource, TableResource, SchemaResource
+from vanguard.db import models, util as u, constants, shards
+from . import lib, columnar, batching
 
 
 def setup_dirs(recreate=False):
@@ -21,17 +23,160 @@ def setup_dirs(recreate=False):
     constants.TRAIN.mkdir(exist_ok=True)
 
 
-def build_out_db(source_table: str):
+def recreate_stages(
+    recreate: str, n_shards: int = 0, prep_aggregates: bool = False
+) -> List[str]:
+    """
+    Args:
+        recreate (str): The --recreate option (other than auto).
+        n_shards (int): The --shards option.
+        prep_aggregates (bool): The --prep_aggregates option.
+    Returns:
+        List[str]: The names of the pipeline stages to re-run.
+    """
+    if n_shards:
+        stages = dict(
+            all=["prep", "shards", "train"],
+            db=["shards"],
+            call=["shards"],
+            train=["train"],
+        )
+    else:
+        # With prep_aggregates, cenblocks is written from the census block
+        # aggregates prep saved, rather than by populate.
+        cenblocks = ["cenblocks"] if prep_aggregates else []
+        build = ["tables"] + cenblocks + ["populate"]
+        stages = dict(
+            all=["prep"] + build + ["calls", "districts", "train"],
+            db=build + ["districts"],
+            call=["calls", "districts"],
+            train=["train"],
+        )
+    return stages.get(recreate, [])
+
+
+def prep_raw_data(
+    raw_file: Path,
+    batch_size: int = 100000,
+    manual_header: str = None,
+    aggregate_cenblocks: bool = False,
+    memory_budget: float = None,
+):
+    h = None
+    if manual_header:
+        h = pd.read_csv(f"datastore/templates/{manual_header}")
+        h = h["column"].tolist()
+    p = PrepData(
+        lib.prep_raw_data,
+        batch_size=batch_size,
+        manual_header=h,
+        aggregate_cenblocks=aggregate_cenblocks,
+        batcher=batching.batcher_from_mb(memory_budget),
+    )
+    # The cenblocks stage writes the cenblocks table from the saved
+    # aggregates.
+    p.execute(raw_file.stem, write_cenblocks=False)
+    for name, st in lib.donation_cache_stats().items():
+        print(
+            f"Donation {name} cache: {st['hits']} hits, {st['misses']} misses "
+            f"({st['hit_rate']:.1%} hit rate), {st['size']} cached."
+        )
+    u.print_bar()
+
+
+def clear_prepped_data(source_table: str):
+    """
+    Removes the prepped raw data table and PrepData's checkpoints so
+    that the raw data can be prepped again from the beginning.
+
+    Args:
+        source_table (str): The name of the prepped raw data table.
+    """
+    PrepData.clear(source_table)
+
+
+def write_prepped_cenblocks(source_table: str):
+    """
+    Replaces the contents of the cenblocks table with the census block
+    aggregates saved while source_table was prepped with
+    aggregate_cenblocks, so the cenblocks table can be rebuilt without
+    re-prepping the raw data.
+
+    Args:
+        source_table (str): The name of the prepped raw data table.
+    """
+    engine = sa.create_engine(constants.SQL_ALCHEMY_SIMDB)
+    drop_district_triggers(engine.url.database)
+    try:
+        p = PrepData(lib.prep_raw_data, aggregate_cenblocks=True)
+        p.load_checkpoints(engine, source_table)
+        p.write_cenblocks(engine)
+    finally:
+        engine.dispose()
+
+
+def create_tables(engine: Engine, normalized: bool = False):
+    print("Begin table creation.")
+    u.print_bar()
+    voters = models.Voter.__tablename__
+    with engine.begin() as conn:
+        # voters is a view over the encoded tables in normalized mode and
+        # a table otherwise, depending on how the database was last built.
+        voters_type = conn.execute(
+            sa.text("SELECT type FROM sqlite_master WHERE name = :name"),
+            dict(name=voters),
+        ).scalar()
+        if voters_type == "view":
+            conn.execute(sa.text(f"DROP VIEW {voters}"))
+    models.Base.metadata.drop_all(engine)
+    if normalized:
+        tables = [t for t in models.Base.metadata.sorted_tables if t.name != voters]
+        models.Base.metadata.create_all(engine, tables=tables)
+        with engine.begin() as conn:
+            conn.execute(sa.text(u.gen_voters_view()))
+    else:
+        models.Base.metadata.create_all(engine)
+    print("Table creation complete.")
+    u.print_bar()
+
+
+def build_out_db(
+    source_table: str,
+    backend: str = "sqlite",
+    populate_cenblocks: bool = True,
+    normalized: bool = False,
+):
     print("Begin database build out...")
     u.print_bar()
+    drop_district_triggers()
     conn = sqlite3.connect(constants.SIMDB)
     c = conn.cursor()
     try:
-        print("Populating census blocks (cenblocks) table...")
-        c.execute(lib.gen_populate_cenblocks(source_table))
+        if populate_cenblocks:
+            print("Clearing out any existing cenblocks data...")
+            c.execute("DELETE FROM cenblocks;")
+            conn.commit()
+            print("Populating census blocks (cenblocks) table...")
+            if backend == "duckdb":
+                columnar.populate_cenblocks(source_table)
+            else:
+                c.execute(lib.gen_populate_cenblocks(source_table))
+                conn.commit()
+        print("Clearing out any existing voters data...")
+        if normalized:
+            for t in [models.EncodedVoter, models.VoterDonations] + [
+                m for m, _ in models.EncodedVoter.code_columns.values()
+            ]:
+                c.execute(f"DELETE FROM {t.__tablename__};")
+        else:
+            c.execute("DELETE FROM voters;")
         conn.commit()
         print("Populating voters table...")
-        c.execute(lib.gen_populate_voters(source_table))
+        if normalized:
+            for statement in lib.gen_populate_encoded_voters(source_table):
+                c.execute(statement)
+        else:
+            c.execute(lib.gen_populate_voters(source_table))
         conn.commit()
         print("Table population complete.")
         u.print_bar()
@@ -40,15 +185,188 @@ def build_out_db(source_table: str):
     print("Database build out complete.")
 
 
+def drop_district_triggers(db: str = None):
+    """
+    Drops the triggers that keep the districts table up to date, ahead
+    of a bulk load into the cenblocks or calls table. build_districts
+    reinstalls them once it has rebuilt districts from scratch.
+
+    Args:
+        db (str): The path to the SQLite database file. Default is None,
+            which means the simulated database.
+    """
+    conn = sqlite3.connect(db or constants.SIMDB)
+    try:
+        for statement in lib.gen_drop_district_triggers():
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_districts(source_table: str):
+    """
+    Rebuilds the cenblock_districts and districts tables from scratch
+    and (re)installs the triggers that keep districts up to date as the
+    cenblocks and calls tables change afterwards.
+
+    Args:
+        source_table (str): The name of the prepped raw data table. If
+            it has no district_num column, every census block is put in
+            the district # at the end of its name (e.g. oh_dist4).
+    """
+    print("Building district rollups...")
+    conn = sqlite3.connect(constants.SIMDB)
+    try:
+        cols = [r[1] for r in conn.execute(f"PRAGMA table_info({source_table})")]
+        district_num = None
+        if "district_num" not in cols:
+            district_num = lib.guess_district_num(source_table)
+        conn.execute("DELETE FROM cenblock_districts;")
+        conn.execute(lib.gen_populate_cenblock_districts(source_table, district_num))
+        conn.execute("DELETE FROM districts;")
+        conn.execute(lib.gen_populate_districts())
+        for statement in lib.gen_district_triggers():
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+    print("District rollups complete.")
+
+
+def build_out_shard(
+    source_table: str,
+    shard: int,
+    n_shards: int,
+    pos_resp_rate: float = 0.1,
+    num_samples: int = None,
+    batch_size: int = 100000,
+    seed: int = None,
+    memory_budget: float = None,
+) -> int:
+    """
+    Creates a single shard of the simulated database from scratch and
+    populates its cenblocks, voters and calls tables with the census
+    blocks in the shard's counties. Shards are separate SQLite files, so
+    this can safely be run for every shard at once.
+
+    Args:
+        source_table (str): The name of the prepped raw data table.
+        shard (int): The shard to build out.
+        n_shards (int): The total # of shards.
+        pos_resp_rate (float): The positive call response rate to
+            simulate.
+        num_samples (int): The max # of calls to generate for the shard.
+            Default is None, which means one call per voter.
+        batch_size (int): The batch size for call generation.
+        seed (int): A seed for the call generation. Default is None.
+        memory_budget (float): If passed, call generation batches are
+            sized to use about this many MB instead of batch_size rows.
+    Returns:
+        int: The # of voters in the shard.
+    """
+    p = shards.shard_path(shard)
+    if p.exists():
+        p.unlink()
+    engine = sa.create_engine(
+        f"sqlite:///{p}", connect_args=dict(check_same_thread=False)
+    )
+    models.Base.metadata.create_all(engine)
+    src = shards.gen_shard_source(f"src.{source_table}", shard, n_shards)
+    conn = sqlite3.connect(p)
+    try:
+        conn.execute(f"ATTACH DATABASE '{constants.SIMDB}' AS src")
+        conn.execute(lib.gen_populate_cenblocks(src))
+        conn.execute(lib.gen_populate_voters(src))
+        conn.commit()
+        n_voters = conn.execute("SELECT COUNT(*) FROM voters").fetchone()[0]
+    finally:
+        conn.close()
+    if n_voters:
+        session = u.connect_to_sim_db(engine)
+        try:
+            lib.gen_call_data(
+                session,
+                pos_resp_rate=pos_resp_rate,
+                num_samples=min(num_samples, n_voters) if num_samples else None,
+                batch_size=batch_size,
+                seed=seed,
+                batcher=batching.batcher_from_mb(memory_budget),
+            )
+        finally:
+            session.close()
+    engine.dispose()
+    print(f"Shard {shard} built out ({n_voters} voters).")
+    return n_voters
+
+
+def build_out_shards(
+    source_table: str,
+    n_shards: int,
+    pos_resp_rate: float = 0.1,
+    num_samples: int = None,
+    batch_size: int = 100000,
+    processes: int = None,
+    seed: int = None,
+    memory_budget: float = None,
+):
+    """
+    Builds out a sharded simulated database in datastore/sim_db/shards,
+    with voters, calls and cenblocks split across n_shards SQLite files
+    by county. Each shard is built in its own process.
+
+    Args:
+        source_table (str): The name of the prepped raw data table.
+        n_shards (int): The # of shards.
+        pos_resp_rate (float): The positive call response rate to
+            simulate.
+        num_samples (int): The total # of calls to generate, split
+            evenly between the shards. Default is None, which means one
+            call per voter.
+        batch_size (int): The batch size for call generation.
+        processes (int): The # of shards to build at once. Default is
+            None, which builds them all at once.
+        seed (int): A seed for the call generation. Each shard is
+            seeded with seed + its shard #. Default is None.
+        memory_budget (float): See build_out_shard.
+    """
+    print(f"Begin sharded database build out ({n_shards} shards)...")
+    u.print_bar()
+    constants.SHARDS.mkdir(parents=True, exist_ok=True)
+    per_shard = math.ceil(num_samples / n_shards) if num_samples else None
+    with ProcessPoolExecutor(max_workers=processes or n_shards) as pool:
+        futures = [
+            pool.submit(
+                build_out_shard,
+                source_table,
+                i,
+                n_shards,
+                pos_resp_rate,
+                per_shard,
+                batch_size,
+                seed + i if seed is not None else None,
+                memory_budget,
+            )
+            for i in range(n_shards)
+        ]
+        n_voters = sum(f.result() for f in futures)
+    u.print_bar()
+    print(f"Sharded database build out complete ({n_voters} voters).")
+
+
 def gen_and_populate_calls(
     engine: Engine,
     pos_resp_rate: float = 0.1,
     num_samples: int = None,
     batch_size: int = 100000,
+    seed: int = None,
+    use_ratings: bool = False,
+    memory_budget: float = None,
 ):
     u.print_bar()
     print("Begin simulated call data generation...")
     u.print_bar()
+    drop_district_triggers(engine.url.database)
     session = u.connect_to_sim_db(engine)
     print("Clearing out any existing call data...")
     try:
@@ -63,13 +381,20 @@ def gen_and_populate_calls(
         pos_resp_rate=pos_resp_rate,
         num_samples=num_samples,
         batch_size=batch_size,
+        seed=seed,
+        use_ratings=use_ratings,
+        batcher=batching.batcher_from_mb(memory_budget),
     )
     u.print_bar()
     print("Simulated call data generated.")
 
 
 def create_training_data(
-    engine: Engine, num_samples: int = None, batch_size: int = 100000
+    engine: Engine,
+    num_samples: int = None,
+    batch_size: int = 100000,
+    backend: str = "sqlite",
+    memory_budget: float = None,
 ):
     u.print_bar()
     print("Begin production of training data...")
@@ -79,113 +404,286 @@ def create_training_data(
     if p.exists():
         p.unlink()
     print("Preparing new census block rating training data...")
-    session = u.connect_to_sim_db(engine)
-    try:
-        lib.prep_cenblock_training_data(
-            session, num_samples=num_samples, batch_size=batch_size
+    if backend == "duckdb":
+        columnar.export_cenblock_training_data(
+            num_samples=num_samples, batch_size=batch_size
         )
-    finally:
-        session.close()
+    else:
+        session = u.connect_to_sim_db(engine)
+        try:
+            lib.prep_cenblock_training_data(
+                session,
+                num_samples=num_samples,
+                batch_size=batch_size,
+                batcher=batching.batcher_from_mb(memory_budget),
+            )
+        finally:
+            session.close()
     print("Census block rating training data prep complete.")
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        "Create a simulated database from the target raw_data."
-    )
-
-    parser.add_argument(
-        "--raw_file",
-        "-r",
-        help="The name of the file in datastore/raw_data to build from. "
-        "Default is the first file in raw_data (alphabetically).",
-    )
+def create_sharded_training_data(
+    n_shards: int,
+    num_samples: int = None,
+    batch_size: int = 100000,
+    memory_budget: float = None,
+):
+    """
+    Exports the census block rating training data from a sharded
+    simulated database one shard at a time, rather than through
+    shards.create_sharded_engine, which can only attach 10 shards.
 
-    parser.add_argument(
-        "--recreate",
-        "-c",
-        default="n",
-        help="Determines what parts, if any, of the simulated database "
-        "to create from scratch ("
-        "db=Build out the database, "
-        "call=Re-generate the call data, "
-        "train=Re-prep the training data, "
-        "all=Recreate everything, "
-        "n=Do not re-create anything (this is the default)).",
-    )
+    Args:
+        n_shards (int): The # of shards.
+        num_samples (int): The maximum # of census blocks to export
+            across all the shards. Default is None, which means all of
+            them.
+        batch_size (int): The batch size for the export.
+        memory_budget (float): If passed, batches are sized to use about
+            this many MB instead of batch_size rows.
+    """
+    u.print_bar()
+    print("Begin production of training data...")
+    u.print_bar()
+    print("Clearing out any existing census block rating training data...")
+    p = constants.TRAIN.joinpath("cenblocks.csv")
+    if p.exists():
+        p.unlink()
+    batcher = batching.batcher_from_mb(memory_budget)
+    written = 0
+    for i in range(n_shards):
+        if num_samples is not None and written >= num_samples:
+            break
+        print(f"Preparing census block rating training data from shard {i}...")
+        session = shards.connect_to_shard(i)
+        try:
+            written += lib.prep_cenblock_training_data(
+                session,
+                num_samples=num_samples - written if num_samples else None,
+                batch_size=batch_size,
+                batcher=batcher,
+                append=p.exists(),
+            )
+        finally:
+            session.close()
+    print("Census block rating training data prep complete.")
 
-    parser.add_argument(
-        "--batch_size",
-        "-b",
-        type=int,
-        default=100000,
-        help="The batch size for various steps of the data preparation "
-        "stage. Default is 100,000",
-    )
 
-    parser.add_argument(
-        "--num_samples",
-        "-n",
-        type=int,
-        help="The # of call/census samples to generate. Default is "
-        "the # of records in the voter/cenblocks table.",
-    )
+def build_pipeline(
+    raw_file: Path,
+    engine: Engine,
+    batch_size: int = 100000,
+    num_samples: int = None,
+    pos_resp_rate: float = 0.1,
+    manual_header: str = None,
+    max_workers: int = 1,
+    backend: str = "sqlite",
+    n_shards: int = 0,
+    prep_aggregates: bool = False,
+    normalized: bool = False,
+    seed: int = None,
+    use_ratings: bool = False,
+    memory_budget: float = None,
+) -> Pipeline:
+    """
+    Assembles the stages of simulated database creation into a Pipeline
+    so that only the stages whose inputs have changed need to be re-run.
 
-    parser.add_argument(
-        "--pos_resp_rate",
-        "-p",
-        type=float,
-        default=0.1,
-        help="The percentage of call samples to be generated as positive "
-        "responses. Default is 0.1.",
+    Args:
+        raw_file (Path): The name of the file in datastore/raw_data to
+            build from.
+        engine (Engine): A SQLAlchemy Engine connected to the simulated
+            database.
+        batch_size (int): The batch size for the various stages.
+        num_samples (int): The # of call/census samples to generate.
+        pos_resp_rate (float): The positive call response rate to
+            simulate.
+        manual_header (str): The name of a csv file in
+            datastore/templates to pull the raw data header from.
+        max_workers (int): The maximum # of stages to run at once.
+        backend (str): The engine to run the aggregation and export
+            stages with, sqlite or duckdb.
+        n_shards (int): If greater than 0, the table creation, population
+            and call generation stages are replaced by one that builds
+            out a database sharded into this many files.
+        prep_aggregates (bool): If True, the cenblocks table is built
+            while the raw data is prepped, rather than by a second pass
+            over the prepped data. Ignored if n_shards is greater than
+            0.
+        normalized (bool): If True, voters are stored dictionary-encoded
+            in voters_encoded and voter_donations, behind a voters view.
+            Ignored if n_shards is greater than 0.
+        seed (int): A seed for call generation.
+        use_ratings (bool): If True, simulated call responses are
+            weighted by census block rating and donor status. Ignored if
+            n_shards is greater than 0.
+        memory_budget (float): If passed, the prep, call generation and
+            training data stages size their batches to use about this
+            many MB, instead of using batch_size.
+    Returns:
+        Pipeline: The simulated database creation Pipeline.
+    """
+    source = raw_file.stem
+    raw = FileResource(constants.RAW.joinpath(f"{source}.csv"))
+    prepped = TableResource(constants.SIMDB, source)
+    prepped_aggs = TableResource(constants.SIMDB, CENBLOCK_AGGS)
+    schema = SchemaResource(constants.SIMDB, models.Base.metadata.tables.keys())
+    cenblocks = TableResource(constants.SIMDB, models.CensusBlock.__tablename__)
+    if normalized:
+        voters = [
+            TableResource(constants.SIMDB, t.__tablename__)
+            for t in (models.EncodedVoter, models.VoterDonations)
+        ]
+    else:
+        voters = [TableResource(constants.SIMDB, models.Voter.__tablename__)]
+    calls = TableResource(constants.SIMDB, models.Call.__tablename__)
+    districts = [
+        TableResource(constants.SIMDB, t.__tablename__)
+        for t in (models.District, models.CenblockDistrict)
+    ]
+    ratings = TableResource(constants.SIMDB, models.CenblockRating.__tablename__)
+    train = FileResource(constants.TRAIN.joinpath("cenblocks.csv"))
+    aggregate = prep_aggregates and not n_shards
+    prep = Stage(
+        "prep",
+        lambda: prep_raw_data(
+            raw_file,
+            batch_size,
+            manual_header,
+            aggregate_cenblocks=aggregate,
+            memory_budget=memory_budget,
+        ),
+        inputs=[raw],
+        outputs=[prepped, prepped_aggs] if aggregate else [prepped],
+        params=dict(manual_header=manual_header, aggregate_cenblocks=aggregate),
+        reset=lambda: clear_prepped_data(source),
     )
-
-    parser.add_argument(
-        "--manual_header",
-        "-m",
-        help="The name of a csv file in datastore/templates to pull the "
-        "header from. Useful if your raw data file has no header row.",
+    populate = Stage(
+        "populate",
+        lambda: build_out_db(
+            source,
+            backend,
+            populate_cenblocks=not aggregate,
+            normalized=normalized,
+        ),
+        inputs=[prepped, schema],
+        outputs=voters if aggregate else [cenblocks] + voters,
     )
+    if n_shards:
+        shard_cenblocks = [
+            TableResource(shards.shard_path(i), models.CensusBlock.__tablename__)
+            for i in range(n_shards)
+        ]
+        shard_others = [
+            TableResource(shards.shard_path(i), t.__tablename__)
+            for i in range(n_shards)
+            for t in (models.Voter, models.Call)
+        ]
+        stages = [
+            prep,
+            Stage(
+                "shards",
+                lambda: build_out_shards(
+                    source,
+                    n_shards,
+                    pos_resp_rate=pos_resp_rate,
+                    num_samples=num_samples,
+                    batch_size=batch_size,
+                    seed=seed,
+                    memory_budget=memory_budget,
+                ),
+                inputs=[prepped, FileResource(Path(models.__file__))],
+                outputs=shard_cenblocks + shard_others,
+                params=dict(
+                    n_shards=n_shards,
+                    pos_resp_rate=pos_resp_rate,
+                    num_samples=num_samples,
+                    seed=seed,
+                ),
+            ),
+            Stage(
+                "train",
+                lambda: create_sharded_training_data(
+                    n_shards,
+                    num_samples=num_samples,
+                    batch_size=batch_size,
+                    memory_budget=memory_budget,
+                ),
+                inputs=shard_cenblocks,
+                outputs=[train],
+                params=dict(num_samples=num_samples),
+            ),
+        ]
+        return Pipeline(
+            stages, constants.SIM.joinpath("pipeline_state.json"), max_workers
+        )
+    stages = [
+        prep,
+        Stage(
+            "tables",
+            lambda: create_tables(engine, normalized),
+            inputs=[FileResource(Path(models.__file__))],
+            outputs=[schema],
+            params=dict(normalized=normalized),
+        ),
+    ]
+    if aggregate:
+        stages.append(
+            Stage(
+                "cenblocks",
+                lambda: write_prepped_cenblocks(source),
+                inputs=[prepped_aggs, schema],
+                outputs=[cenblocks],
+            )
+        )
+    stages += [
+        populate,
+        Stage(
+            "calls",
+            lambda: gen_and_populate_calls(
+                engine,
+                pos_resp_rate=pos_resp_rate,
+                num_samples=num_samples,
+                batch_size=batch_size,
+                seed=seed,
+                use_ratings=use_ratings,
+                memory_budget=memory_budget,
+            ),
+            inputs=voters + ([ratings] if use_ratings else []),
+            outputs=[calls],
+            params=dict(
+                pos_resp_rate=pos_resp_rate,
+                num_samples=num_samples,
+                seed=seed,
+                use_ratings=use_ratings,
+            ),
+        ),
+        Stage(
+            "districts",
+            lambda: build_districts(source),
+            inputs=[prepped, cenblocks, calls] + voters,
+            outputs=districts,
+        ),
+        Stage(
+            "train",
+            lambda: create_training_data(
+                engine,
+                num_samples=num_samples,
+                batch_size=batch_size,
+                backend=backend,
+                memory_budget=memory_budget,
+            ),
+            inputs=[cenblocks],
+            outputs=[train],
+            params=dict(num_samples=num_samples),
+        ),
+    ]
+    return Pipeline(stages, constants.SIM.joinpath("pipeline_state.json"), max_workers)
 
-    args = parser.parse_args()
-
-    raw_file = args.raw_file
-    if not raw_file:
-        raw_file = os.listdir("datastore/raw_data")[0]
-    raw_file = Path(raw_file)
-    setup_dirs(args.recreate == "all")
-
-    if args.recreate == "all":
-        h = None
-        if args.manual_header:
-            h = pd.read_csv(f"datastore/templates/{args.manual_header}")
-            h = h["column"].tolist()
-        p = PrepData(lib.prep_raw_data, batch_size=args.batch_size, manual_header=h)
-        p.execute(raw_file.stem)
-        u.print_bar()
 
-    engine = sa.create_engine(
-        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
-    )
+if __name__ == "__main__":
+    import sys
 
-    if args.recreate in ["all", "db"]:
-        print("Begin table creation.")
-        u.print_bar()
-        models.Base.metadata.drop_all(engine)
-        models.Base.metadata.create_all(engine)
-        print("Table creation complete.")
-        u.print_bar()
-        build_out_db(raw_file.stem)
+    from .cli import main
 
-    if args.recreate in ["all", "call", "train"]:
-        if args.recreate in ["all", "call"]:
-            gen_and_populate_calls(
-                engine,
-                pos_resp_rate=args.pos_resp_rate,
-                num_samples=args.num_samples,
-                batch_size=args.batch_size,
-            )
-        if args.recreate in ["all", "train"]:
-            create_training_data(
-                engine, num_samples=args.num_samples, batch_size=args.batch_size
-            )
+    main(["create"] + sys.argv[1:])
@@ -1,61 +1,132 @@
 from typing import Optional, List, Union, Tuple
-import math
 import re
 import datetime as dt
+import functools
 
 from sqlalchemy.orm import Session
 import numpy as np
 import pandas as pd
 
-from vanguard.db.models import CensusBlock, Voter, Call
+from vanguard.db.models import (
+    CensusBlock,
+    Voter,
+    Call,
+    EncodedVoter,
+    VoterDonations,
+)
 from vanguard.db import constants
+from vanguard import simulate
+from .batching import AdaptiveBatcher
 
+# The cenblocks columns that are sums of a prepped raw data column. All
+# other cenblocks columns are the max of the raw column of the same name.
+CENBLOCK_SUMS = dict(total_donors="is_donor", donation_total="total")
+# The cenblocks columns that are summed into the districts table.
+DISTRICT_SUMS = ["totalpop", "total_donors", "donation_total"]
 
-def donation_dt_to_datetime(d_date: str) -> dt.datetime:
+
+# Donation strings repeat heavily across voters (small amounts on the
+# same few filing dates), so parsed dates and donation summaries are
+# memoized for the life of the process, across PrepData chunks.
+DONATION_CACHE_SIZE = 100000
+DATE_PATTERNS = [
+    (re.compile(r"\d{2}/\d{2}/\d{4}"), "%m/%d/%Y"),
+    (re.compile(r"\d{2}/\d{4}"), "%m/%Y"),
+    (re.compile(r"\d{4}"), "%Y"),
+]
+
+
+@functools.lru_cache(maxsize=DONATION_CACHE_SIZE)
+def donation_dt_to_datetime(d_date: str) -> Optional[dt.datetime]:
     """
     Takes a donation date string and converts it to a datetime object.
 
     Args:
         d_date (str): A date string with dates separated by /
     Returns:
-        datetime: A datetime object based on d_date, or d_date if no
+        datetime: A datetime object based on d_date, or None if no
             pattern match is found.
     """
-    patterns = {
-        r"\d{2}/\d{2}/\d{4}": "%m/%d/%Y",
-        r"\d{2}/\d{4}": "%m/%Y",
-        r"\d{4}": "%Y",
-    }
-    result = dt.datetime(0, 0, 0)
-    for re_p, dt_fmt in patterns.items():
-        if re.search(re.compile(re_p), d_date):
+    result = None
+    for re_p, dt_fmt in DATE_PATTERNS:
+        if re_p.search(d_date):
             result = dt.datetime.strptime(d_date, dt_fmt)
             break
     return result
 
 
-def unpack_donation_col(donation_col: str) -> Tuple[float, float, int]:
+@functools.lru_cache(maxsize=DONATION_CACHE_SIZE)
+def summarize_donations(
+    donation_col: str,
+) -> Tuple[float, float, Optional[dt.datetime]]:
+    """
+    Args:
+        donation_col (str): A string of donation data in the format of
+            {$1@date1,$2@date2}.
+    Returns:
+        tuple: The total and average donation, and the date of the first
+            donation in the string (the most recent). The date is None if
+            there are no donations or it can't be parsed.
+    """
+    donation_col = re.sub(r"[{}$]", "", donation_col)
+    if donation_col == "":
+        return 0, 0, None
+    donations = [x.split("@") for x in donation_col.split(",")]
+    amts = [float(x[0]) for x in donations]
+    return (
+        float(sum(amts)),
+        float(np.mean(amts)),
+        donation_dt_to_datetime(donations[0][1]),
+    )
+
+
+def unpack_donation_col(
+    donation_col: str, now: Optional[dt.datetime] = None
+) -> Tuple[float, float, int]:
     """
     Unpacks a string of donation data in the format of
     {$1@date1,$2@date2} into a dictionary of metadata on that string.
 
     Args:
         donation_col (str): A string of donation data.
+        now (Optional[datetime], optional): The time to count days since
+            the last donation from. Defaults to None, which means now.
     Returns:
-        tuple: A tuple of metadata about the passed donation data.
+        tuple: A tuple of metadata about the passed donation data. Days
+            since the last donation is -1 if there are no donations or
+            its date can't be parsed.
     """
-    output = (0, 0, -1)
-    donation_col = re.sub(r"[{}$]", "", donation_col)
-    if donation_col != "":
-        donations = [x.split("@") for x in donation_col.split(",")]
-        amts = [float(x[0]) for x in donations]
-        last_dt = donation_dt_to_datetime(donations[0][1])
-        output = (
-            float(sum(amts)),
-            float(np.mean(amts)),
-            (dt.datetime.now() - last_dt).days,
+    total, avg, last_dt = summarize_donations(donation_col)
+    if last_dt is None:
+        return total, avg, -1
+    return total, avg, ((now or dt.datetime.now()) - last_dt).days
+
+
+def donation_cache_stats() -> dict:
+    """
+    Returns:
+        dict: The hits, misses, current size and hit rate of the
+            donation date and donation string caches, by cache.
+    """
+    stats = dict()
+    for name, f in [
+        ("dates", donation_dt_to_datetime),
+        ("donations", summarize_donations),
+    ]:
+        info = f.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = dict(
+            hits=info.hits,
+            misses=info.misses,
+            size=info.currsize,
+            hit_rate=info.hits / lookups if lookups else 0.0,
         )
-    return output
+    return stats
+
+
+def clear_donation_caches() -> None:
+    donation_dt_to_datetime.cache_clear()
+    summarize_donations.cache_clear()
 
 
 def prep_raw_data(df: pd.DataFrame) -> pd.DataFrame:
@@ -71,8 +142,10 @@ def prep_raw_data(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         (DataFrame): The transformed DataFrame.
     """
+    now = dt.datetime.now()
     df[["total", "avg", "days_since"]] = pd.DataFrame(
-        df["demdonationamounts"].apply(unpack_donation_col).tolist(), index=df.index
+        [unpack_donation_col(d, now) for d in df["demdonationamounts"]],
+        index=df.index,
     )
     df["party_affiliation"] = df["party_affiliation"].fillna("X")
     df["is_donor"] = df["total"].apply(lambda x: x > 0).astype("int")
@@ -84,6 +157,10 @@ def gen_call_data(
     pos_resp_rate: Optional[float] = 0.1,
     num_samples: Optional[int] = None,
     batch_size: Optional[int] = 250000,
+    seed: Optional[int] = None,
+    use_ratings: Optional[bool] = False,
+    donor_lift: Optional[float] = 1.0,
+    batcher: Optional[AdaptiveBatcher] = None,
 ) -> None:
     """
     Generates simulated call data and loads into the database connected
@@ -101,33 +178,44 @@ def gen_call_data(
             you want to pull from the voter table. Use this if your
             voter table is very large. Defaults to 250000, or
             num_samples if that is lower.
+        seed (Optional[int], optional): A seed for the random number
+            generator, to make the simulation reproducible. Defaults to
+            None.
+        use_ratings (Optional[bool], optional): If True, each voter's
+            chance of a positive response is weighted by their census
+            block's rating in cenblock_ratings and whether they are a
+            donor (see vanguard.simulate.response_probabilities), rather
+            than every voter having the same chance. Defaults to False.
+        donor_lift (Optional[float], optional): See
+            vanguard.simulate.response_probabilities. Defaults to 1.0.
+        batcher (Optional[AdaptiveBatcher], optional): If passed,
+            batches are sized to fit its memory budget instead of being
+            batch_size rows. Defaults to None.
     """
     if num_samples is None:
         num_samples = session.query(Voter).count()
+    rng = np.random.default_rng(seed)
+    cols = [getattr(Voter, c) for c in simulate.voter_columns(use_ratings)]
+    ratings = simulate.load_block_ratings(session) if use_ratings else None
     start = 1
-    end = batch_size if batch_size < num_samples else num_samples
-    num_batches = math.ceil(num_samples / batch_size)
-    for i in range(num_batches):
-        print(
-            f"Processing batch {i + 1} of {num_batches} (rows {start} " f"to {end})...",
-            end="\r",
-        )
+    while start <= num_samples:
+        size = batcher.next_size() if batcher is not None else batch_size
+        end = min(start + size - 1, num_samples)
+        print(f"Processing rows {start} to {end} of {num_samples}...", end="\r")
         batch = (
-            session.query(Voter, Voter.ohvfid)
-            .filter(Voter.id >= start)
-            .filter(Voter.id <= end)
-            .all()
+            session.query(*cols).filter(Voter.id >= start).filter(Voter.id <= end).all()
         )
-        df = pd.DataFrame(batch)
-        x = df.sample(frac=pos_resp_rate).index.tolist()
-        df["result"] = df.index.isin(x).astype(int)
-        calls = df.apply(
-            lambda row: Call(ohvfid=row.ohvfid, call_result=row.result), axis=1
+        df = pd.DataFrame(batch, columns=[c.key for c in cols])
+        if batcher is not None:
+            batcher.observe(df)
+        df["call_result"] = simulate.simulate_calls(
+            rng, df, pos_resp_rate, ratings, donor_lift
+        )
+        session.bulk_insert_mappings(
+            Call, df[["ohvfid", "call_result"]].to_dict("records")
         )
-        session.add_all(list(calls))
         session.commit()
-        start += batch_size
-        end += batch_size
+        start = end + 1
     print("\nAll batches successfully processed.")
 
 
@@ -135,14 +223,43 @@ def prep_cenblock_training_data(
     session: Session,
     num_samples: Optional[int] = None,
     batch_size: Optional[int] = 250000,
-) -> None:
+    batcher: Optional[AdaptiveBatcher] = None,
+    append: Optional[bool] = False,
+) -> int:
+    """
+    Writes the cenblocks table out as census block rating training data,
+    in datastore/batch_train/cenblocks.csv.
+
+    Args:
+        session (Session): A SQLAlchemy Session object.
+        num_samples (Optional[int], optional): The maximum # of census
+            blocks to write. Defaults to None, which means all of them.
+        batch_size (Optional[int], optional): The # of census blocks to
+            process at a time. Defaults to 250,000.
+        batcher (Optional[AdaptiveBatcher], optional): If passed,
+            batches are sized to fit its memory budget instead of being
+            batch_size rows. Defaults to None.
+        append (Optional[bool], optional): If True, the census blocks
+            are added to the end of an existing cenblocks.csv, without a
+            header. Defaults to False.
+    Returns:
+        int: The # of census blocks written.
+    """
     if num_samples is None:
         num_samples = session.query(CensusBlock).count()
-    first_batch = True
-    write_mode = "w"
+    first_batch = not append
+    write_mode = "a" if append else "w"
     rows_processed = 0
-    query = session.query(CensusBlock)
-    for df in pd.read_sql(query.statement, session.bind, chunksize=batch_size):
+    result = session.execute(CensusBlock.__table__.select())
+    columns = list(result.keys())
+    while rows_processed < num_samples:
+        size = batcher.next_size() if batcher is not None else batch_size
+        rows = result.fetchmany(min(size, num_samples - rows_processed))
+        if not rows:
+            break
+        df = pd.DataFrame(rows, columns=columns)
+        if batcher is not None:
+            batcher.observe(df)
         print(
             f"Processing rows {rows_processed + 1} to "
             f"{rows_processed + len(df)}...",
@@ -159,9 +276,73 @@ def prep_cenblock_training_data(
         write_mode = "a"
         first_batch = False
         rows_processed += len(df)
-        if rows_processed >= num_samples:
-            break
+    result.close()
     print("\nAll rows successfully processed.")
+    return rows_processed
+
+
+class CenblockAggregator:
+    """
+    Maintains running per-blockgeoid aggregates of prepped raw data as
+    it is processed chunk by chunk, so that the cenblocks table can be
+    populated without a second pass over the prepped raw data table.
+    The aggregates are the same as those in gen_populate_cenblocks.
+    """
+
+    def __init__(self):
+        self.aggs: Optional[pd.DataFrame] = None
+
+    @staticmethod
+    def _funcs(columns: List[str]) -> dict:
+        cols = CensusBlock.gen_column_list()[2:]  # Remove id and blockgeoid.
+        return {
+            k: (CENBLOCK_SUMS.get(k, k), "sum" if k in CENBLOCK_SUMS else "max")
+            for k in cols
+            if CENBLOCK_SUMS.get(k, k) in columns
+        }
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds a chunk of prepped raw data to the running aggregates.
+
+        Args:
+            df (DataFrame): A chunk of prepped raw data, with a
+                blockgeoid column.
+        Returns:
+            DataFrame: The chunk's own aggregates, in the same format as
+                to_frame. Passing these to merge (e.g. after saving and
+                reloading them) has the same effect as this update.
+        """
+        funcs = self._funcs(df.columns)
+        chunk = df.groupby("blockgeoid", dropna=False).agg(**funcs)
+        self.merge(chunk.reset_index())
+        return chunk.reset_index()
+
+    def merge(self, aggs: pd.DataFrame) -> None:
+        """
+        Adds already aggregated census blocks to the running aggregates.
+
+        Args:
+            aggs (DataFrame): Aggregates in the format returned by
+                update and to_frame. A blockgeoid may appear more than
+                once.
+        """
+        aggs = aggs.set_index("blockgeoid")
+        if self.aggs is not None:
+            aggs = pd.concat([self.aggs, aggs])
+        self.aggs = aggs.groupby(level=0, dropna=False).agg(
+            {k: "sum" if k in CENBLOCK_SUMS else "max" for k in aggs.columns}
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns:
+            DataFrame: The aggregates, with one row per blockgeoid and
+                columns matching the cenblocks table.
+        """
+        if self.aggs is None:
+            return pd.DataFrame(columns=CensusBlock.gen_column_list()[1:])
+        return self.aggs.reset_index()
 
 
 def gen_populate_cenblocks(source_table: str) -> str:
@@ -175,10 +356,26 @@ def gen_populate_cenblocks(source_table: str) -> str:
         str: A SQL insert and select statement as a str, tailored to the
             needs of the cenblocks table.
     """
-    do_func = dict(
-        total_donors="SUM(is_donor)",
-        donation_total="SUM(total)",
-    )
+    cenblocks_cols = CensusBlock.gen_column_list()
+    cenblocks_cols.pop(0)  # Remove id column.
+    insert = gen_insert_table("cenblocks", cenblocks_cols)
+    return f"{insert} {gen_select_cenblocks(source_table)}"
+
+
+def gen_select_cenblocks(source_table: str) -> str:
+    """
+    Convenience function for generating the select statement that
+    aggregates the prepped raw data table into census blocks. Each
+    aggregate is aliased to its cenblocks column name, so the statement
+    can also be run on its own by engines other than SQLite.
+    -
+    Args:
+        source_table (str): The name of the table to pull data from.
+    Returns:
+        str: A SQL select statement as a str, with one column per
+            cenblocks column (other than id).
+    """
+    do_func = {k: f"SUM({v})" for k, v in CENBLOCK_SUMS.items()}
     do_nothing = ["blockgeoid"]
     select_cols = []
     cenblocks_cols = CensusBlock.gen_column_list()
@@ -187,12 +384,10 @@ def gen_populate_cenblocks(source_table: str) -> str:
         if k in do_nothing:
             select_cols.append(k)
         elif k in do_func.keys():
-            select_cols.append(do_func[k])
+            select_cols.append(f"{do_func[k]} AS {k}")
         else:
-            select_cols.append(f"MAX({k})")
-    insert = gen_insert_table("cenblocks", cenblocks_cols)
-    select = gen_select(source_table, select_cols, do_nothing)
-    return f"{insert} {select}"
+            select_cols.append(f"MAX({k}) AS {k}")
+    return gen_select(source_table, select_cols, do_nothing)
 
 
 def gen_populate_voters(source_table: str) -> str:
@@ -213,6 +408,223 @@ def gen_populate_voters(source_table: str) -> str:
     return f"{insert} {select}"
 
 
+def gen_populate_encoded_voters(source_table: str) -> List[str]:
+    """
+    Convenience function for generating the statements needed to
+    populate the normalized voter storage (the lookup tables,
+    voters_encoded and voter_donations) from the prepped raw data table.
+    The statements must be run in order on the same connection.
+    -
+    Args:
+        source_table (str): The name of the table to pull data from.
+    Returns:
+        List[str]: SQL statements as strs.
+    """
+    v_cols = Voter.gen_column_list()
+    v_cols.pop(0)  # Remove id column.
+    statements = [
+        "DROP TABLE IF EXISTS temp.voters_stage;",
+        f"CREATE TEMP TABLE voters_stage AS {gen_select(source_table, v_cols, v_cols)}",
+    ]
+    e_cols = EncodedVoter.gen_column_list()
+    select_cols = []
+    joins = []
+    codes = {code: (c, m) for c, (m, code) in EncodedVoter.code_columns.items()}
+    for k in e_cols:
+        if k in codes:
+            c, model = codes[k]
+            t = model.__tablename__
+            statements.append(
+                f"{gen_insert_table(t, ['value'])}SELECT DISTINCT {c} FROM "
+                f"voters_stage WHERE {c} IS NOT NULL;"
+            )
+            select_cols.append(f"{t}.code")
+            joins.append(f"LEFT JOIN {t} ON {t}.value = s.{c}")
+        elif k == "id":
+            select_cols.append("s.rowid")
+        else:
+            select_cols.append(f"s.{k}")
+    statements.append(
+        f"{gen_insert_table(EncodedVoter.__tablename__, e_cols)}"
+        f"SELECT {', '.join(select_cols)} FROM voters_stage s {' '.join(joins)};"
+    )
+    d_cols = VoterDonations.gen_column_list()
+    statements.append(
+        f"{gen_insert_table(VoterDonations.__tablename__, d_cols)}"
+        f"SELECT rowid, {', '.join(d_cols[1:])} FROM voters_stage;"
+    )
+    statements.append("DROP TABLE temp.voters_stage;")
+    return statements
+
+
+def gen_populate_cenblock_districts(
+    source_table: str, district_num: Optional[int] = None
+) -> str:
+    """
+    Convenience function for generating the insert statement needed to
+    populate the cenblock_districts table, which maps each census block
+    to a district, from the prepped raw data table.
+    -
+    Args:
+        source_table (str): The name of the table to pull data from.
+        district_num (Optional[int], optional): If passed, every census
+            block is mapped to this district. Defaults to None, which
+            means the source table's district_num column is used. Some
+            voters have more than one district_num, so a census block
+            is mapped to the highest one among its voters.
+    Returns:
+        str: A SQL insert and select statement as a str.
+    """
+    insert = gen_insert_table("cenblock_districts", ["blockgeoid", "district_num"])
+    d = "MAX(district_num)" if district_num is None else str(int(district_num))
+    return (
+        f"{insert}SELECT blockgeoid, {d} FROM {source_table} "
+        f"WHERE blockgeoid IS NOT NULL GROUP BY blockgeoid;"
+    )
+
+
+def guess_district_num(source_table: str) -> int:
+    """
+    Args:
+        source_table (str): The name of a prepped raw data table, e.g.
+            oh_dist4.
+    Returns:
+        int: The district # at the end of the table name, or 1 if there
+            isn't one.
+    """
+    m = re.search(r"(\d+)$", source_table)
+    return int(m.group(1)) if m else 1
+
+
+def gen_populate_districts() -> str:
+    """
+    Convenience function for generating the insert statement needed to
+    populate the districts table from the cenblocks and calls tables.
+    A voter's calls count towards the district of their census block.
+    -
+    Returns:
+        str: A SQL insert and select statement as a str.
+    """
+    cols = ["district_num", "district"] + DISTRICT_SUMS
+    cols += ["total_calls", "positive_calls"]
+    sums = [f"COALESCE(SUM(c.{k}), 0)" for k in DISTRICT_SUMS]
+    # Each call's census block is looked up through the voters ohvfid
+    # index, as in the triggers. Joining a grouped voters subquery
+    # instead makes SQLite scan it once per call.
+    calls = (
+        "SELECT b.district_num, COUNT(*) AS total_calls, "
+        "COALESCE(SUM(calls.call_result), 0) AS positive_calls FROM calls "
+        "JOIN cenblock_districts b ON b.blockgeoid = (SELECT MAX(blockgeoid) "
+        "FROM voters WHERE ohvfid = calls.ohvfid) "
+        "GROUP BY b.district_num"
+    )
+    select = gen_select(
+        "cenblocks c JOIN cenblock_districts b ON b.blockgeoid = c.blockgeoid "
+        f"LEFT JOIN ({calls}) k ON k.district_num = b.district_num",
+        ["b.district_num", "'District ' || b.district_num"]
+        + sums
+        + ["COALESCE(MAX(k.total_calls), 0)", "COALESCE(MAX(k.positive_calls), 0)"],
+        ["b.district_num"],
+    )
+    return f"{gen_insert_table('districts', cols)}{select}"
+
+
+def gen_district_triggers() -> List[str]:
+    """
+    Convenience function for generating the statements that (re)create
+    the triggers which keep the districts table up to date as rows are
+    inserted into, deleted from or updated in the cenblocks and calls
+    tables.
+    -
+    Returns:
+        List[str]: SQL statements as strs.
+    """
+    cb_district = (
+        "(SELECT district_num FROM cenblock_districts WHERE blockgeoid = "
+        "{r}.blockgeoid)"
+    )
+    call_district = (
+        "(SELECT district_num FROM cenblock_districts WHERE blockgeoid = "
+        "(SELECT MAX(blockgeoid) FROM voters WHERE ohvfid = {r}.ohvfid))"
+    )
+    cols = ["district_num", "district"] + DISTRICT_SUMS
+    cols += ["total_calls", "positive_calls"]
+    zeros = ", ".join("0" for _ in cols[2:])
+
+    def ensure(district: str) -> str:
+        return (
+            f"INSERT OR IGNORE INTO districts ({', '.join(cols)}) "
+            f"SELECT d, 'District ' || d, {zeros} FROM (SELECT {district} AS d) "
+            f"WHERE d IS NOT NULL;"
+        )
+
+    def cenblock(r: str, sign: str) -> str:
+        sets = ", ".join(
+            f"{k} = {k} {sign} COALESCE({r}.{k}, 0)" for k in DISTRICT_SUMS
+        )
+        return (
+            f"UPDATE districts SET {sets} "
+            f"WHERE district_num = {cb_district.format(r=r)};"
+        )
+
+    def call(r: str, sign: str) -> str:
+        return (
+            f"UPDATE districts SET total_calls = total_calls {sign} 1, "
+            f"positive_calls = positive_calls {sign} COALESCE({r}.call_result, 0) "
+            f"WHERE district_num = {call_district.format(r=r)};"
+        )
+
+    triggers = dict(
+        districts_cenblocks_insert=(
+            "AFTER INSERT ON cenblocks",
+            [ensure(cb_district.format(r="NEW")), cenblock("NEW", "+")],
+        ),
+        districts_cenblocks_delete=(
+            "AFTER DELETE ON cenblocks",
+            [cenblock("OLD", "-")],
+        ),
+        districts_cenblocks_update=(
+            "AFTER UPDATE ON cenblocks",
+            [
+                cenblock("OLD", "-"),
+                ensure(cb_district.format(r="NEW")),
+                cenblock("NEW", "+"),
+            ],
+        ),
+        districts_calls_insert=(
+            "AFTER INSERT ON calls",
+            [ensure(call_district.format(r="NEW")), call("NEW", "+")],
+        ),
+        districts_calls_delete=("AFTER DELETE ON calls", [call("OLD", "-")]),
+        districts_calls_update=(
+            "AFTER UPDATE ON calls",
+            [
+                call("OLD", "-"),
+                ensure(call_district.format(r="NEW")),
+                call("NEW", "+"),
+            ],
+        ),
+    )
+    statements = []
+    for name, (event, body) in triggers.items():
+        statements.append(f"DROP TRIGGER IF EXISTS {name};")
+        statements.append(
+            f"CREATE TRIGGER {name} {event} FOR EACH ROW BEGIN {' '.join(body)} END;"
+        )
+    return statements
+
+
+def gen_drop_district_triggers() -> List[str]:
+    """
+    Convenience function for generating the statements that drop the
+    triggers created by gen_district_triggers.
+    -
+    Returns:
+        List[str]: SQL statements as strs.
+    """
+    return [s for s in gen_district_triggers() if s.startswith("DROP TRIGGER")]
+
+
 def gen_insert_table(table_name: str, columns: List[str]) -> str:
     """
     Convenience method for generating an insert statement based on one
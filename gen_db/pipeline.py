@@ -0,0 +1,394 @@
+import hashlib
+import json
+import sqlite3
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def _connect_ro(db: Path) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+
+
+class Resource:
+    """
+    Something a Stage reads or writes. Every Resource has a unique key,
+    a lock key naming the storage that serializes access to it, and a
+    cheap fingerprint that changes whenever its contents change.
+    """
+
+    key: str = ""
+    lock: str = ""
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def fingerprint(self) -> Optional[str]:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}({self.key})>"
+
+
+class FileResource(Resource):
+    """
+    A file on disk, fingerprinted by its size and modification time.
+
+    Args:
+        path (Path): The path to the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.key = f"file:{self.path}"
+        self.lock = self.key
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def fingerprint(self) -> Optional[str]:
+        if not self.exists():
+            return None
+        s = self.path.stat()
+        return _hash(s.st_size, s.st_mtime_ns)
+
+
+class TableResource(Resource):
+    """
+    A table in a SQLite database, fingerprinted by its definition, row
+    count and max rowid. Writes are serialized on the database file.
+
+    Args:
+        db (Path): The path to the SQLite database file.
+        table (str): The name of the table.
+    """
+
+    def __init__(self, db: Path, table: str):
+        self.db = Path(db)
+        self.table = table
+        self.key = f"table:{self.db}:{table}"
+        self.lock = f"file:{self.db}"
+
+    def _sql(self, c: sqlite3.Connection) -> Optional[str]:
+        r = c.execute(
+            "SELECT sql FROM sqlite_master WHERE name = ?", (self.table,)
+        ).fetchone()
+        return r[0] if r else None
+
+    def exists(self) -> bool:
+        if not self.db.exists():
+            return False
+        c = _connect_ro(self.db)
+        try:
+            return self._sql(c) is not None
+        finally:
+            c.close()
+
+    def fingerprint(self) -> Optional[str]:
+        if not self.db.exists():
+            return None
+        c = _connect_ro(self.db)
+        try:
+            sql = self._sql(c)
+            if sql is None:
+                return None
+            ct, max_id = c.execute(
+                f"SELECT COUNT(*), MAX(rowid) FROM {self.table}"
+            ).fetchone()
+            return _hash(sql, ct, max_id)
+        finally:
+            c.close()
+
+
+class SchemaResource(Resource):
+    """
+    The definitions of a set of tables in a SQLite database. Unlike
+    TableResource, populating the tables does not change the
+    fingerprint, only changing their definitions does.
+
+    Args:
+        db (Path): The path to the SQLite database file.
+        tables (Iterable[str]): The names of the tables.
+    """
+
+    def __init__(self, db: Path, tables: Iterable[str]):
+        self.db = Path(db)
+        self.tables = sorted(tables)
+        self.key = f"schema:{self.db}:{','.join(self.tables)}"
+        self.lock = f"file:{self.db}"
+
+    def _defs(self) -> Dict[str, str]:
+        if not self.db.exists():
+            return dict()
+        c = _connect_ro(self.db)
+        try:
+            q = "SELECT name, sql FROM sqlite_master WHERE name IN ({})".format(
+                ", ".join("?" for _ in self.tables)
+            )
+            return dict(c.execute(q, self.tables).fetchall())
+        finally:
+            c.close()
+
+    def exists(self) -> bool:
+        return len(self._defs()) == len(self.tables)
+
+    def fingerprint(self) -> Optional[str]:
+        d = self._defs()
+        if len(d) != len(self.tables):
+            return None
+        return _hash(*[d[t] for t in self.tables])
+
+
+class Stage:
+    """
+    A single step of a Pipeline.
+
+    Args:
+        name (str): A unique name for the stage.
+        func (Callable): A function that takes no arguments and performs
+            the stage's work.
+        inputs (Iterable[Resource]): The resources the stage reads.
+        outputs (Iterable[Resource]): The resources the stage writes.
+        params (dict, optional): Any settings that affect the stage's
+            outputs. Changing them causes the stage to be re-run.
+        reset (Callable, optional): A function that takes no arguments
+            and is called before re-running a stage that previously
+            completed. Use this for stages that would otherwise resume
+            where they left off.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: Iterable[Resource] = (),
+        outputs: Iterable[Resource] = (),
+        params: dict = None,
+        reset: Callable = None,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or dict()
+        self.reset = reset
+
+    @property
+    def locks(self) -> Set[str]:
+        return {o.lock for o in self.outputs}
+
+    @property
+    def shared_locks(self) -> Set[str]:
+        """
+        The storage the stage only reads. Readers don't block each other,
+        but a SQLite writer can't commit while a reader has the file open.
+        """
+        return {i.lock for i in self.inputs} - self.locks
+
+    def __repr__(self):
+        return f"<Stage({self.name})>"
+
+
+class Pipeline:
+    """
+    Runs a set of Stages in dependency order, skipping any stage whose
+    inputs, outputs and params are unchanged since it last ran. A stage
+    depends on whichever stage produces one of its inputs, and is always
+    re-run if one of its dependencies has been since it last ran.
+    Independent stages are run concurrently, except that a stage writing
+    to some storage (e.g. a SQLite file) is never run at the same time as
+    another stage that reads or writes it.
+
+    Args:
+        stages (List[Stage]): The stages of the pipeline.
+        state_file (Path): A json file to record stage fingerprints in
+            between runs.
+        max_workers (int): The maximum # of stages to run at once.
+            Default is 1.
+    """
+
+    def __init__(self, stages: List[Stage], state_file: Path, max_workers: int = 1):
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique.")
+        self.state_file = Path(state_file)
+        self.max_workers = max_workers
+        producers = dict()
+        for s in stages:
+            for o in s.outputs:
+                if o.key in producers:
+                    raise ValueError(
+                        f"{o} is output by both {producers[o.key]} and {s.name}."
+                    )
+                producers[o.key] = s.name
+        self.producers = producers
+        self.upstream = {
+            s.name: {producers[i.key] for i in s.inputs if i.key in producers}
+            for s in stages
+        }
+        self.order = self._toposort()
+
+    def _toposort(self) -> List[str]:
+        order = []
+        done = set()
+        visiting = set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} is part of a dependency cycle.")
+            visiting.add(name)
+            for u in sorted(self.upstream[name]):
+                visit(u)
+            visiting.remove(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def load_state(self) -> dict:
+        """
+        Returns:
+            dict: The fingerprints recorded for each stage on its last
+                successful run.
+        """
+        if self.state_file.exists():
+            with open(self.state_file, "r") as r:
+                return json.load(r)
+        return dict()
+
+    def save_state(self, state: dict):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, "w") as w:
+            json.dump(state, w, indent=2)
+
+    def _snapshot(self, stage: Stage, state: dict) -> dict:
+        # Fingerprints can't tell a table apart from one rebuilt with the
+        # same row count, so each input also records the generation its
+        # producer wrote on the producer's last run.
+        generations = dict()
+        for i in stage.inputs:
+            if i.key in self.producers:
+                producer = state.get(self.producers[i.key], dict())
+                generations[i.key] = producer.get("generations", dict()).get(i.key)
+        return dict(
+            inputs={i.key: i.fingerprint() for i in stage.inputs},
+            outputs={o.key: o.fingerprint() for o in stage.outputs},
+            params=stage.params,
+            upstream=generations,
+        )
+
+    def is_stale(self, stage: Stage, state: dict) -> bool:
+        """
+        Args:
+            stage (Stage): The stage to check.
+            state (dict): The state as returned by load_state.
+        Returns:
+            bool: True if the stage has never completed, any of its
+                outputs is missing, any of its fingerprints differ from
+                the recorded ones, or a stage it depends on has been run
+                since it last completed.
+        """
+        if stage.name not in state:
+            return True
+        if not all(o.exists() for o in stage.outputs):
+            return True
+        recorded = dict(state[stage.name])
+        recorded.pop("generations", None)
+        return self._snapshot(stage, state) != recorded
+
+    def run(
+        self, force: Iterable[str] = (), only: Optional[Iterable[str]] = None
+    ) -> List[str]:
+        """
+        Runs every stage that is not up to date.
+
+        Args:
+            force (Iterable[str]): Names of stages to run even if they
+                are up to date.
+            only (Iterable[str], optional): If passed, only these stages
+                will be considered, and all others are treated as up to
+                date.
+        Returns:
+            List[str]: The names of the stages that were run, in the
+                order they completed.
+        """
+        force = set(force)
+        only = set(only) if only is not None else set(self.stages)
+        unknown = (force | only) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}")
+        state = self.load_state()
+        pending = [n for n in self.order if n in only]
+        finished = set(self.stages) - only
+        ran = []
+        running = dict()
+        held = set()
+        shared = Counter()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                progress = True
+                while progress and error is None:
+                    progress = False
+                    for name in list(pending):
+                        if not self.upstream[name] <= finished:
+                            continue
+                        stage = self.stages[name]
+                        if (
+                            name not in force
+                            and not (self.upstream[name] & set(ran))
+                            and not self.is_stale(stage, state)
+                        ):
+                            print(f"Stage {name} is up to date, skipping.")
+                            pending.remove(name)
+                            finished.add(name)
+                            progress = True
+                            continue
+                        if (
+                            stage.locks & (held | set(+shared))
+                            or stage.shared_locks & held
+                            or len(running) >= self.max_workers
+                        ):
+                            continue
+                        print(f"Running stage {name}...")
+                        if stage.reset is not None and name in state:
+                            stage.reset()
+                        state.pop(name, None)
+                        self.save_state(state)
+                        held |= stage.locks
+                        shared.update(stage.shared_locks)
+                        running[pool.submit(stage.func)] = name
+                        pending.remove(name)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    name = running.pop(f)
+                    stage = self.stages[name]
+                    held -= stage.locks
+                    shared.subtract(stage.shared_locks)
+                    if f.exception() is not None:
+                        error = error or f.exception()
+                        continue
+                    state[name] = self._snapshot(stage, state)
+                    generation = uuid.uuid4().hex
+                    state[name]["generations"] = {
+                        o.key: generation for o in stage.outputs
+                    }
+                    self.save_state(state)
+                    finished.add(name)
+                    ran.append(name)
+                    print(f"Stage {name} complete.")
+        if error is not None:
+            raise error
+        return ran
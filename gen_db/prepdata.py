@@ -1,14 +1,22 @@
 import os
 import logging as log
-from typing import Callable, List
-from pathlib import Path
+from typing import Callable, List, Tuple
 import json
 from datetime import datetime as dt
 
 import pandas as pd
+import sqlalchemy as sa
 import datagenius as dg
 
-from components.db import constants, util as u
+from vanguard.db import constants, models, util as u
+from .lib import CenblockAggregator
+from .batching import AdaptiveBatcher
+
+# The tables that PrepData checkpoints each prepped chunk in, and saves
+# each chunk's census block aggregates in, so that both are committed
+# in the same transaction as the chunk itself.
+CHECKPOINTS = "prep_checkpoints"
+CENBLOCK_AGGS = "prep_cenblock_aggs"
 
 
 class PrepData:
@@ -29,6 +37,16 @@ class PrepData:
         batch_size (int): The # to divide the raw input data into,
             default is 100,000. Pick a # that your PC can efficiently
             process in memory.
+        manual_header (List[str]): A header to use for raw input data
+            that has no header row.
+        aggregate_cenblocks (bool): If True, per-blockgeoid aggregates
+            are maintained as each chunk is processed and written to the
+            cenblocks table once all chunks are done, so the cenblocks
+            table doesn't need to be populated from the prepped data
+            afterwards. Default is False.
+        batcher (AdaptiveBatcher): If passed, chunks are sized to fit its
+            memory budget instead of being batch_size rows. Default is
+            None.
     """
 
     def __init__(
@@ -36,96 +54,298 @@ class PrepData:
         prep_func: Callable,
         batch_size: int = 100000,
         manual_header: List[str] = None,
+        aggregate_cenblocks: bool = False,
+        batcher: AdaptiveBatcher = None,
     ):
         self._func = prep_func
-        self._prep_cache = constants.SIM.joinpath("prep_cache.json")
         self.batch_size = batch_size
+        self._batcher = batcher
         self._header = manual_header
-        self._chunks = 1
-        self._rows_processed = 0
+        self._done = dict()
+        self._aggregator = CenblockAggregator() if aggregate_cenblocks else None
 
-    def execute(self, file_name: str, col_map: dict = None):
+    def execute(
+        self, file_name: str, col_map: dict = None, write_cenblocks: bool = True
+    ):
         """
         Executes the prep function on the target file (which must be
         found in your model directory's datastore/input_data directory)
-        in batches. After each successful batch the results will be
-        cached and saved, so that if you stop mid-execution and start
-        again later, you won't have to restart from the beginning of
-        your data file.
+        in batches. Each batch's results are committed to the database
+        in the same transaction as a checkpoint recording its rows, so
+        that if you stop mid-execution and start again later, you won't
+        have to restart from the beginning of your data file, and no
+        batch is ever written twice (even by two PrepDatas running at
+        once).
 
         Args:
             file_name (str): The name of the data file to prep.
             col_map (str): A dictionary produced by
                 lib.import_column_map, if your file contains columns you
                 want to drop.
+            write_cenblocks (bool): If False, the census block
+                aggregates are only saved with each chunk, and not
+                written to the cenblocks table at the end (e.g. because
+                another step writes it from the saved aggregates).
+                Ignored unless aggregate_cenblocks is True. Default is
+                True.
         """
-        if self._prep_cache.exists():
-            self.load_cache()
-        ignore = col_map["ignored"] if col_map else None
-        print(f"Processing file {file_name} in chunks of {self.batch_size}")
         if ".csv" in file_name:
             file_name, _ = os.path.splitext(file_name)
+        engine = sa.create_engine(
+            constants.SQL_ALCHEMY_SIMDB, connect_args=dict(timeout=60)
+        )
+        try:
+            self.load_checkpoints(engine, file_name)
+            written_elsewhere = self._execute(engine, file_name, col_map)
+            if self._aggregator is not None and write_cenblocks:
+                if written_elsewhere:
+                    # Pick up the aggregates of the chunks another
+                    # PrepData wrote while this one was running.
+                    self.load_checkpoints(engine, file_name)
+                self.write_cenblocks(engine)
+        finally:
+            engine.dispose()
+
+    def _execute(self, engine: sa.engine.Engine, file_name: str, col_map: dict) -> bool:
+        """
+        Returns:
+            bool: True if any chunk was written by another PrepData
+                while this one was running.
+        """
+        written_elsewhere = False
+        ignore = col_map["ignored"] if col_map else None
+        if self._batcher is not None:
+            print(
+                f"Processing file {file_name} in chunks of up to "
+                f"{self._batcher.memory_budget / 1024 ** 2:.0f}MB"
+            )
+        else:
+            print(f"Processing file {file_name} in chunks of {self.batch_size}")
         p = constants.RAW.joinpath(f"{file_name}.csv")
-        chunks = 1
+        reader = pd.read_csv(p, iterator=True)
+        rows_processed = 0
+        chunk = 0
         start = dt.now()
         u.print_bar()
-        for raw in pd.read_csv(p, chunksize=self.batch_size):
-            if chunks < self._chunks:
+        while True:
+            size, done = self._next_chunk(rows_processed)
+            try:
+                raw = reader.get_chunk(size)
+            except StopIteration:
+                break
+            chunk += 1
+            row_end = rows_processed + len(raw)
+            if done:
                 print(
-                    f"Skipping chunk {chunks} (Rows {self._rows_processed}) to "
-                    f"{self._rows_processed + len(raw)} it has been processed "
-                    f"in a previous session.",
+                    f"Skipping chunk {chunk} (Rows {rows_processed} to "
+                    f"{row_end}), it has been processed in a previous session.",
                     end="\r",
                 )
-            else:
-                print(
-                    f"Processing chunk {chunks} (Rows {self._rows_processed} to "
-                    f"{self._rows_processed + len(raw)}). Total runtime = "
-                    f"{dt.now() - start}."
-                )
-                u.print_bar()
-                chunk_start = dt.now()
-                if self._header is None:
-                    h, _ = dg.standardize_header(raw.columns)
-                    self._header = h
-                    raw.columns = h
-                print("Beginning preprocessing...")
-                step_start = dt.now()
-                raw, md = raw.genius.preprocess(manual_header=self._header)
-                print(f"Preprocess complete. Runtime = {dt.now() - step_start}")
-                print(f"Applying {self._func.__name__}...")
-                raw, md = self._func(raw, md)
-                if ignore:
-                    print("Removing ignored columns...")
-                    raw.drop(columns=ignore, inplace=True)
-                print(f"Writing chunk to {constants.SIM}/datasets db...")
-                raw.genius.to_sqlite(constants.SIM, file_name, drop_first=False)
+                rows_processed = row_end
+                continue
+            print(
+                f"Processing chunk {chunk} (Rows {rows_processed} to "
+                f"{row_end}). Total runtime = {dt.now() - start}."
+            )
+            u.print_bar()
+            chunk_start = dt.now()
+            if self._batcher is not None:
+                self._batcher.observe(raw)
+            if self._header is None:
+                h, _ = dg.standardize_header(raw.columns)
+                self._header = h
+                raw.columns = h
+            print("Beginning preprocessing...")
+            step_start = dt.now()
+            raw, md = raw.genius.preprocess(manual_header=self._header)
+            print(f"Preprocess complete. Runtime = {dt.now() - step_start}")
+            print(f"Applying {self._func.__name__}...")
+            raw, md = self._func(raw, md)
+            if ignore:
+                print("Removing ignored columns...")
+                raw.drop(columns=ignore, inplace=True)
+            print(f"Writing chunk to {constants.SIM}/datasets db...")
+            if self.write_chunk(engine, file_name, raw, chunk, rows_processed, row_end):
                 print(
-                    f"Chunk {chunks} processed (Rows {self._rows_processed} to "
-                    f"{self._rows_processed + len(raw)}). "
-                    f"Runtime={dt.now() - chunk_start}"
+                    f"Chunk {chunk} processed (Rows {rows_processed} to "
+                    f"{row_end}). Runtime={dt.now() - chunk_start}"
                 )
-                print(f"Saving cache...")
-                self._chunks += 1
-                self.save_cache()
-                u.print_bar()
-            self._rows_processed += len(raw)
-            chunks += 1
+            else:
+                print(f"Chunk {chunk} was written by another process, skipping.")
+                written_elsewhere = True
+            u.print_bar()
+            rows_processed = row_end
         print(f"Data preparation complete. Total runtime = {dt.now() - start}")
+        return written_elsewhere
 
-    def load_cache(self):
+    def _next_chunk(self, row_start: int) -> Tuple[int, bool]:
         """
-        Loads a saved PrepData cache from the sim_db directory.
+        Args:
+            row_start (int): The first row of the next chunk.
+        Returns:
+            Tuple[int, bool]: The # of rows to read for the next chunk,
+                and whether that chunk has already been prepped. Chunks
+                line up with previously prepped ones, so a resumed run
+                can use a different batch_size or memory budget.
         """
-        with open(self._prep_cache, "r") as r:
-            c = json.load(r)
-        for k, v in c.items():
-            setattr(self, "_" + k, v)
+        if row_start in self._done:
+            return self._done[row_start] - row_start, True
+        if self._batcher is not None:
+            size = self._batcher.next_size()
+        else:
+            size = self.batch_size
+        later = [s for s in self._done if s > row_start]
+        if later:
+            size = min(size, min(later) - row_start)
+        return size, False
 
-    def save_cache(self):
+    def write_chunk(
+        self,
+        engine: sa.engine.Engine,
+        file_name: str,
+        df: pd.DataFrame,
+        chunk: int,
+        row_start: int,
+        row_end: int,
+    ) -> bool:
         """
-        Saves the PrepData cache to the sim_db directory.
+        Appends a prepped chunk to the file_name table and checkpoints
+        it, along with its census block aggregates if
+        aggregate_cenblocks is True, in a single transaction.
+
+        Args:
+            engine (Engine): An Engine connected to the simulated db.
+            file_name (str): The name of the data file being prepped.
+            df (DataFrame): The prepped chunk.
+            chunk (int): The chunk #.
+            row_start (int): The first row of the chunk in the file.
+            row_end (int): The row after the last row of the chunk.
+        Returns:
+            bool: False if the chunk had already been checkpointed by
+                another PrepData, in which case nothing is written.
         """
-        c = dict(header=self._header, chunks=self._chunks)
-        with open(self._prep_cache, "w") as w:
-            json.dump(c, w)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    sa.text(
+                        f"INSERT INTO {CHECKPOINTS} (file_name, chunk, row_start, "
+                        f"row_end, header, completed_at) VALUES (:file_name, "
+                        f":chunk, :row_start, :row_end, :header, :completed_at)"
+                    ),
+                    dict(
+                        file_name=file_name,
+                        chunk=chunk,
+                        row_start=row_start,
+                        row_end=row_end,
+                        header=json.dumps(self._header),
+                        completed_at=dt.now().isoformat(),
+                    ),
+                )
+                overlaps = conn.execute(
+                    sa.text(
+                        f"SELECT COUNT(*) FROM {CHECKPOINTS} WHERE file_name = "
+                        f":file_name AND row_start < :row_end AND "
+                        f"row_end > :row_start AND row_start != :row_start"
+                    ),
+                    dict(file_name=file_name, row_start=row_start, row_end=row_end),
+                ).scalar()
+                if overlaps:
+                    # Another PrepData with different chunk sizes got to
+                    # some of these rows first.
+                    raise _ChunkConflict()
+                df.to_sql(file_name, conn, if_exists="append", index=False)
+                if self._aggregator is not None:
+                    aggs = self._aggregator.update(df).assign(file_name=file_name)
+                    aggs.to_sql(CENBLOCK_AGGS, conn, if_exists="append", index=False)
+        except (sa.exc.IntegrityError, _ChunkConflict):
+            return False
+        self._done[row_start] = row_end
+        return True
+
+    def write_cenblocks(self, engine: sa.engine.Engine):
+        """
+        Replaces the contents of the cenblocks table with the census
+        block aggregates, creating the table if it doesn't exist.
+        """
+        print("Writing census block aggregates to cenblocks table...")
+        models.CensusBlock.__table__.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            conn.execute(sa.text("DELETE FROM cenblocks;"))
+            self._aggregator.to_frame().to_sql(
+                "cenblocks", conn, if_exists="append", index=False
+            )
+
+    def load_checkpoints(self, engine: sa.engine.Engine, file_name: str):
+        """
+        Loads the chunks of file_name that have already been prepped,
+        along with the header and census block aggregates saved with
+        them.
+        """
+        with engine.begin() as conn:
+            create_checkpoints_table(conn)
+            r = conn.execute(
+                sa.text(
+                    f"SELECT row_start, row_end, header FROM {CHECKPOINTS} "
+                    f"WHERE file_name = :file_name ORDER BY row_start"
+                ),
+                dict(file_name=file_name),
+            ).fetchall()
+            self._done = {row_start: row_end for row_start, row_end, _ in r}
+            if r:
+                self._header = json.loads(r[-1][2])
+            if self._aggregator is not None:
+                self._aggregator = CenblockAggregator()
+                if r and sa.inspect(conn).has_table(CENBLOCK_AGGS):
+                    aggs = pd.read_sql(
+                        sa.text(
+                            f"SELECT * FROM {CENBLOCK_AGGS} "
+                            f"WHERE file_name = :file_name"
+                        ),
+                        conn,
+                        params=dict(file_name=file_name),
+                    )
+                    if len(aggs):
+                        self._aggregator.merge(aggs.drop(columns="file_name"))
+
+    @staticmethod
+    def clear(file_name: str):
+        """
+        Drops the file_name table along with its checkpoints and census
+        block aggregates, so that it will be prepped again from the
+        beginning.
+
+        Args:
+            file_name (str): The name of the prepped data file.
+        """
+        engine = sa.create_engine(constants.SQL_ALCHEMY_SIMDB)
+        try:
+            with engine.begin() as conn:
+                create_checkpoints_table(conn)
+                conn.execute(sa.text(f"DROP TABLE IF EXISTS {file_name}"))
+                for t in [CHECKPOINTS, CENBLOCK_AGGS]:
+                    if sa.inspect(conn).has_table(t):
+                        conn.execute(
+                            sa.text(f"DELETE FROM {t} WHERE file_name = :file_name"),
+                            dict(file_name=file_name),
+                        )
+        finally:
+            engine.dispose()
+
+
+class _ChunkConflict(Exception):
+    pass
+
+
+def create_checkpoints_table(conn: sa.engine.Connection):
+    conn.execute(
+        sa.text(
+            f"CREATE TABLE IF NOT EXISTS {CHECKPOINTS} ("
+            f"file_name TEXT NOT NULL, "
+            f"chunk INTEGER NOT NULL, "
+            f"row_start INTEGER NOT NULL, "
+            f"row_end INTEGER NOT NULL, "
+            f"header TEXT, "
+            f"completed_at TEXT, "
+            f"PRIMARY KEY (file_name, row_start))"
+        )
+    )
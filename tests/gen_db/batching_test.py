@@ -0,0 +1,41 @@
+import pandas as pd
+
+from gen_db import batching
+
+
+def test_current_rss():
+    rss = batching.current_rss()
+    assert rss is None or rss > 0
+
+
+def test_adaptive_batcher(monkeypatch):
+    monkeypatch.setattr(batching, "current_rss", lambda: None)
+    df = pd.DataFrame(dict(a=range(100), b=[1.0] * 100))
+    row_bytes = df.memory_usage(index=True, deep=True).sum() / 100
+    b = batching.AdaptiveBatcher(int(row_bytes * 1000), initial=100, min_size=10)
+    assert b.next_size() == 100
+    b.observe(df)
+    assert b.next_size() == 400  # Capped by max_growth.
+    b.observe(df)
+    assert b.next_size() == 1000
+    b.max_size = 500
+    b.observe(df)
+    assert b.next_size() == 500
+
+
+def test_adaptive_batcher_rss_drift(monkeypatch):
+    rss = iter([0, 10**6, 10**6])
+    monkeypatch.setattr(batching, "current_rss", lambda: next(rss))
+    df = pd.DataFrame(dict(a=range(1000)))
+    df_bytes = df.memory_usage(index=True, deep=True).sum()
+    b = batching.AdaptiveBatcher(df_bytes * 10, initial=1000, min_size=1)
+    b.observe(df)
+    assert b.overhead == batching.MAX_OVERHEAD
+    assert b.next_size() == 1000
+    b.observe(df)
+    assert b.overhead < batching.MAX_OVERHEAD
+
+
+def test_batcher_from_mb():
+    assert batching.batcher_from_mb(None) is None
+    assert batching.batcher_from_mb(2).memory_budget == 2 * 1024**2
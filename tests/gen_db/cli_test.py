@@ -0,0 +1,48 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from gen_db import cli
+
+# Modules that take a noticeable amount of time to import, which the CLI
+# should only import once a command that needs them runs.
+HEAVY_MODULES = ["pandas", "numpy", "sqlalchemy", "kafka", "requests", "datagenius"]
+# Generous, so that it only fails if something heavy sneaks back in.
+STARTUP_BUDGET = 2.0
+
+
+def test_cli_imports_are_lazy():
+    code = (
+        "import sys; from gen_db import cli; cli.build_parser(); "
+        f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    )
+    r = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert r.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize(
+    "command", [[], ["build"], ["stream"], ["rate"], ["score"], ["serve"]]
+)
+def test_cli_help_is_within_budget(command):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "gen_db", *command, "--help"],
+        capture_output=True,
+        check=True,
+    )
+    assert time.perf_counter() - start < STARTUP_BUDGET
+
+
+def test_build_parser():
+    parser = cli.build_parser()
+    args = parser.parse_args(["calls", "--auto", "-p", "0.2"])
+    assert args.func is cli.run_stages
+    assert args.auto and args.pos_resp_rate == 0.2
+    args = parser.parse_args(["create", "-c", "auto"])
+    assert args.func is cli.run_create
+    assert args.recreate == "auto"
+    assert parser.parse_args(["stream"]).func is cli.run_stream
@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine
+
+from gen_db import lib, columnar
+from vanguard.db import models, constants
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def sim_db(tmp_path):
+    db = tmp_path.joinpath("datasets.db")
+    engine = create_engine(f"sqlite:///{db}")
+    models.Base.metadata.create_all(engine)
+    engine.dispose()
+    cols = [
+        c
+        for c in models.CensusBlock.gen_column_list()
+        if c not in ("id", "total_donors", "donation_total")
+    ]
+    df = pd.DataFrame([[1] * len(cols)] * 4, columns=cols)
+    df["blockgeoid"] = [1, 1, 2, 3]
+    df["totalpop"] = [10, 10, 20, 40]
+    df["percentunder18"] = [0.1, 0.1, 0.2, 0.3]
+    df["is_donor"] = [1, 0, 1, 1]
+    df["total"] = [5.0, 0.0, 2.5, 10.0]
+    conn = sqlite3.connect(db)
+    df.to_sql("oh_dist4", conn, index=False)
+    conn.close()
+    return db
+
+
+def read_cenblocks(db):
+    conn = sqlite3.connect(db)
+    try:
+        return pd.read_sql("SELECT * FROM cenblocks ORDER BY blockgeoid", conn)
+    finally:
+        conn.close()
+
+
+def test_populate_cenblocks_matches_sqlite(sim_db):
+    conn = sqlite3.connect(sim_db)
+    conn.execute(lib.gen_populate_cenblocks("oh_dist4"))
+    conn.commit()
+    conn.close()
+    expected = read_cenblocks(sim_db).drop(columns="id")
+    conn = sqlite3.connect(sim_db)
+    conn.execute("DELETE FROM cenblocks")
+    conn.commit()
+    conn.close()
+    assert columnar.populate_cenblocks("oh_dist4", db=sim_db, batch_size=2) == 3
+    result = read_cenblocks(sim_db).drop(columns="id")
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result["total_donors"].tolist() == [1, 1, 1]
+    assert result["donation_total"].tolist() == [5.0, 2.5, 10.0]
+
+
+def test_export_cenblock_training_data(sim_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "TRAIN", tmp_path)
+    columnar.populate_cenblocks("oh_dist4", db=sim_db)
+    columnar.export_cenblock_training_data(num_samples=2, db=sim_db)
+    df = pd.read_csv(tmp_path.joinpath("cenblocks.csv"))
+    assert len(df) == 2
+    assert df["donor_pct"].tolist() == [0.1, 0.05]
+    assert len(df.columns) == len(models.CensusBlock.gen_column_list()) - 2
@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+pytest.importorskip("datagenius")
+
+from gen_db import create, lib
+from vanguard.db import constants, models, shards, util
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "print_bar", lambda: None)
+    engine = sa.create_engine(f"sqlite:///{tmp_path.joinpath('datasets.db')}")
+    yield engine
+    engine.dispose()
+
+
+def voters_type(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            sa.text("SELECT type FROM sqlite_master WHERE name = 'voters'")
+        ).scalar()
+
+
+def test_create_tables_twice(engine):
+    for normalized in [False, False, True, True, False]:
+        create.create_tables(engine, normalized)
+        assert voters_type(engine) == ("view" if normalized else "table")
+
+
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "print_bar", lambda: None)
+    monkeypatch.setattr(constants, "SHARDS", tmp_path)
+    monkeypatch.setattr(constants, "TRAIN", tmp_path)
+    # More shards than SQLite can attach at once.
+    n_shards = 12
+    for i in range(n_shards):
+        engine = sa.create_engine(f"sqlite:///{shards.shard_path(i)}")
+        models.Base.metadata.create_all(engine)
+        rows = [
+            dict(blockgeoid=i * 10 + j, totalpop=10, total_donors=j)
+            for j in range(i % 3)
+        ]
+        if rows:
+            with engine.begin() as conn:
+                conn.execute(models.CensusBlock.__table__.insert(), rows)
+        engine.dispose()
+    return n_shards
+
+
+def test_create_sharded_training_data(sharded_db, tmp_path):
+    create.create_sharded_training_data(sharded_db, batch_size=1)
+    df = pd.read_csv(tmp_path.joinpath("cenblocks.csv"))
+    assert len(df) == 12
+    assert sorted(df["donor_pct"].tolist()) == [0.0] * 8 + [0.1] * 4
+    create.create_sharded_training_data(sharded_db, num_samples=5)
+    assert len(pd.read_csv(tmp_path.joinpath("cenblocks.csv"))) == 5
+
+
+def test_rebuild_keeps_prepped_cenblocks(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        constants, "SQL_ALCHEMY_SIMDB", f"sqlite:///{tmp_path.joinpath('datasets.db')}"
+    )
+    p = create.PrepData(lambda df, md: (df, md), aggregate_cenblocks=True)
+    p.load_checkpoints(engine, "oh_dist4")
+    chunk = pd.DataFrame(
+        dict(blockgeoid=[1, 1, 2], totalpop=[5, 5, 6], is_donor=[1, 0, 1])
+    )
+    p.write_chunk(engine, "oh_dist4", chunk, 1, 0, 3)
+    create.create_tables(engine)
+    create.write_prepped_cenblocks("oh_dist4")
+    with engine.connect() as conn:
+        rows = conn.execute(
+            sa.text("SELECT blockgeoid, totalpop, total_donors FROM cenblocks")
+        ).fetchall()
+    assert rows == [(1, 5, 1), (2, 6, 1)]
+
+    stages = create.recreate_stages("db", prep_aggregates=True)
+    assert "prep" not in stages
+    pipeline = create.build_pipeline(
+        tmp_path.joinpath("oh_dist4.csv"), engine, prep_aggregates=True
+    )
+    assert set(stages) <= set(pipeline.stages)
+    # Rebuilding the tables mustn't make prep stale in auto mode either.
+    assert pipeline.upstream["prep"] == set()
+
+
+def test_calls_drop_district_triggers(engine):
+    create.create_tables(engine)
+    with engine.begin() as conn:
+        for statement in lib.gen_district_triggers():
+            conn.execute(sa.text(statement))
+        conn.execute(
+            models.Voter.__table__.insert(),
+            [dict(ohvfid=f"00{i}", blockgeoid=i) for i in range(10)],
+        )
+    create.gen_and_populate_calls(engine, seed=0)
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT COUNT(*) FROM calls")).scalar() == 10
+        triggers = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'"
+        assert conn.execute(sa.text(triggers)).scalar() == 0
@@ -1,13 +1,14 @@
+from datetime import datetime
 from pathlib import Path
 import shutil
 
 import pytest
-from sqlalchemy import create_engine, func as sa_func
+from sqlalchemy import create_engine, func as sa_func, text
 from sqlalchemy.orm import sessionmaker
 import pandas as pd
 
-from gen_db import lib
-from vanguard.db import models, constants
+from gen_db import lib, batching
+from vanguard.db import models, constants, util
 
 
 @pytest.fixture
@@ -55,6 +56,29 @@ def test_gen_call_data(test_db):
     assert test_db.query(sa_func.sum(models.Call.call_result)).one()[0] == 1
 
 
+def test_gen_call_data_is_reproducible(test_db):
+    lib.gen_call_data(test_db, 0.5, seed=7)
+    first = [c.call_result for c in test_db.query(models.Call).all()]
+    test_db.query(models.Call).delete()
+    lib.gen_call_data(test_db, 0.5, seed=7)
+    second = [c.call_result for c in test_db.query(models.Call).all()]
+    assert first == second
+
+
+def test_gen_call_data_w_ratings(test_db):
+    test_db.add(models.CenblockRating(blockgeoid=1, rating=0.5))
+    test_db.commit()
+    lib.gen_call_data(test_db, 0.1, seed=1, use_ratings=True)
+    assert test_db.query(models.Call).count() == 3
+
+
+def test_gen_call_data_w_batcher(test_db):
+    batcher = batching.AdaptiveBatcher(1, initial=2, min_size=1)
+    lib.gen_call_data(test_db, 1 / 3, batcher=batcher)
+    assert test_db.query(models.Call.ohvfid).all() == [("001",), ("002",), ("003",)]
+    assert batcher.row_bytes is not None
+
+
 def test_prep_training_data(test_db, output_dir, monkeypatch):
     monkeypatch.setattr(constants, "TRAIN", output_dir)
     lib.prep_cenblock_training_data(test_db, batch_size=1)
@@ -72,6 +96,46 @@ def test_prep_training_data_w_sample_cap(test_db, output_dir, monkeypatch):
     assert df["donor_pct"].tolist() == [0.25, 0.025]
 
 
+def test_prep_training_data_w_batcher(test_db, output_dir, monkeypatch):
+    monkeypatch.setattr(constants, "TRAIN", output_dir)
+    batcher = batching.AdaptiveBatcher(1, initial=1, min_size=1)
+    lib.prep_cenblock_training_data(test_db, num_samples=2, batcher=batcher)
+    df = pd.read_csv(output_dir.joinpath("cenblocks.csv"))
+    assert df["donor_pct"].tolist() == [0.25, 0.025]
+
+
+def test_unpack_donation_col():
+    now = datetime(2020, 1, 11)
+    assert lib.unpack_donation_col("{$10@01/01/2020,$20@12/2019}", now) == (
+        30.0,
+        15.0,
+        10,
+    )
+    assert lib.unpack_donation_col("{}", now) == (0, 0, -1)
+    assert lib.unpack_donation_col("$5@2019", now)[2] == 375
+    assert lib.unpack_donation_col("$5@unknown", now) == (5.0, 5.0, -1)
+
+
+def test_donation_caches():
+    lib.clear_donation_caches()
+    df = pd.DataFrame(
+        dict(
+            demdonationamounts=["{$10@01/01/2020}", "{$10@01/01/2020}", ""] * 2,
+            party_affiliation=["D", None, "R"] * 2,
+        )
+    )
+    # The caches persist across chunks.
+    lib.prep_raw_data(df.iloc[:3].copy())
+    result = lib.prep_raw_data(df.iloc[3:].copy())
+    assert result["total"].tolist() == [10.0, 10.0, 0]
+    assert result["is_donor"].tolist() == [1, 1, 0]
+    stats = lib.donation_cache_stats()
+    assert stats["donations"] == dict(hits=4, misses=2, size=2, hit_rate=4 / 6)
+    assert stats["dates"]["misses"] == 1
+    lib.clear_donation_caches()
+    assert lib.donation_cache_stats()["donations"]["size"] == 0
+
+
 def test_gen_populate_cenblocks():
     result = lib.gen_populate_cenblocks("oh_dist4")
     assert "MAX(totalpop)" in result
@@ -113,3 +177,107 @@ def test_gen_select_w_groupby():
         )
         == expected
     )
+
+
+def test_cenblock_aggregator():
+    df = pd.DataFrame(
+        dict(
+            blockgeoid=[1, 1, 2, 1, 3],
+            totalpop=[10, 10, 20, 10, 30],
+            percentunder18=[0.1, 0.2, 0.3, 0.15, None],
+            is_donor=[1, 0, 1, 1, 0],
+            total=[5.0, 0.0, 2.5, 1.0, 0.0],
+        )
+    )
+    agg = lib.CenblockAggregator()
+    agg.update(df.iloc[:2])
+    agg.update(df.iloc[2:])
+    result = agg.to_frame()
+    assert result["blockgeoid"].tolist() == [1, 2, 3]
+    assert result["total_donors"].tolist() == [2, 1, 0]
+    assert result["donation_total"].tolist() == [6.0, 2.5, 0.0]
+    assert result["percentunder18"].tolist()[:2] == [0.2, 0.3]
+    assert "totalpop" in result.columns
+    assert "percent18to19" not in result.columns
+
+
+@pytest.fixture
+def normalized_db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    tables = [t for t in models.Base.metadata.sorted_tables if t.name != "voters"]
+    models.Base.metadata.create_all(engine, tables=tables)
+    with engine.begin() as conn:
+        conn.execute(text(util.gen_voters_view()))
+        raw = pd.DataFrame(
+            {c: None for c in models.Voter.gen_column_list()[1:]}, index=[0, 1, 2]
+        )
+        raw["ohvfid"] = ["001", "002", "003"]
+        raw["party_affiliation"] = ["D", "R", "D"]
+        raw["city"] = ["Columbus", "Columbus", None]
+        raw["demdonationamounts"] = ["{$5@01/01/2020}", "", ""]
+        raw.to_sql("oh_dist4", conn, index=False)
+        for statement in lib.gen_populate_encoded_voters("oh_dist4"):
+            conn.execute(text(statement))
+    s = sessionmaker(engine)()
+    yield s
+    s.close()
+
+
+def test_gen_populate_encoded_voters(normalized_db):
+    assert normalized_db.query(models.PartyCode).count() == 2
+    assert normalized_db.query(models.CityCode).count() == 1
+    voters = normalized_db.query(models.Voter).order_by(models.Voter.ohvfid).all()
+    assert [v.party_affiliation for v in voters] == ["D", "R", "D"]
+    assert [v.city for v in voters] == ["Columbus", "Columbus", None]
+    assert voters[0].demdonationamounts == "{$5@01/01/2020}"
+
+
+def test_query_voters(normalized_db):
+    q = util.query_voters(normalized_db, "ohvfid", "party_affiliation")
+    assert "voter_donations" not in str(q.statement)
+    assert "city_codes" not in str(q.statement)
+    assert sorted(q.all()) == [("001", "D"), ("002", "R"), ("003", "D")]
+    q = util.query_voters(normalized_db, "ohvfid", "demdonationamounts")
+    assert "voter_donations" in str(q.statement)
+    assert len(q.all()) == 3
+
+
+def read_districts(conn):
+    return conn.execute(
+        text(
+            "SELECT district_num, totalpop, total_donors, donation_total, "
+            "total_calls, positive_calls FROM districts ORDER BY district_num"
+        )
+    ).fetchall()
+
+
+def test_district_rollups(test_db):
+    conn = test_db.connection()
+    conn.execute(text("CREATE TABLE oh_dist4 (blockgeoid INTEGER)"))
+    conn.execute(text("INSERT INTO oh_dist4 VALUES (1), (2), (3)"))
+    for i, v in enumerate(test_db.query(models.Voter).all()):
+        v.blockgeoid = i + 1
+    test_db.add(models.Call(ohvfid="001", call_result=1))
+    test_db.flush()
+    assert lib.guess_district_num("oh_dist4") == 4
+    conn.execute(text(lib.gen_populate_cenblock_districts("oh_dist4", 4)))
+    conn.execute(text(lib.gen_populate_districts()))
+    assert read_districts(conn) == [(4, 600, 155.0, 0.0, 1, 1)]
+    for statement in lib.gen_district_triggers():
+        conn.execute(text(statement))
+    conn.execute(text("INSERT INTO cenblock_districts VALUES (9, 5)"))
+    test_db.add(models.CensusBlock(blockgeoid=9, total_donors=1, totalpop=10))
+    test_db.add(models.Call(ohvfid="002", call_result=0))
+    test_db.flush()
+    test_db.query(models.CensusBlock).filter_by(blockgeoid=1).delete()
+    test_db.query(models.Call).filter_by(ohvfid="001").update(dict(call_result=0))
+    test_db.flush()
+    incremental = read_districts(conn)
+    assert incremental == [(4, 400, 105.0, 0.0, 2, 0), (5, 10, 1.0, 0.0, 0, 0)]
+    conn.execute(text("DELETE FROM districts"))
+    conn.execute(text(lib.gen_populate_districts()))
+    assert read_districts(conn) == incremental
+    for statement in lib.gen_drop_district_triggers():
+        conn.execute(text(statement))
+    triggers = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'"
+    assert conn.execute(text(triggers)).scalar() == 0
@@ -0,0 +1,245 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from gen_db import pipeline as pl
+
+
+@pytest.fixture
+def files(tmp_path):
+    src = tmp_path.joinpath("src.txt")
+    src.write_text("a")
+    return dict(
+        src=src,
+        mid=tmp_path.joinpath("mid.txt"),
+        out_a=tmp_path.joinpath("out_a.txt"),
+        out_b=tmp_path.joinpath("out_b.txt"),
+        state=tmp_path.joinpath("state.json"),
+    )
+
+
+def copy(a, b, calls, name):
+    def f():
+        calls.append(name)
+        b.write_text(a.read_text() + name)
+
+    return f
+
+
+def build(files, calls, max_workers=1):
+    src, mid = pl.FileResource(files["src"]), pl.FileResource(files["mid"])
+    a, b = pl.FileResource(files["out_a"]), pl.FileResource(files["out_b"])
+    return pl.Pipeline(
+        [
+            pl.Stage("a", copy(files["mid"], files["out_a"], calls, "a"), [mid], [a]),
+            pl.Stage("mid", copy(files["src"], files["mid"], calls, "m"), [src], [mid]),
+            pl.Stage("b", copy(files["mid"], files["out_b"], calls, "b"), [mid], [b]),
+        ],
+        files["state"],
+        max_workers,
+    )
+
+
+def test_pipeline_runs_in_dependency_order(files):
+    calls = []
+    ran = build(files, calls).run()
+    assert calls == ["m", "a", "b"]
+    assert ran == ["mid", "a", "b"]
+    assert files["out_b"].read_text() == "amb"
+
+
+def test_pipeline_skips_up_to_date_stages(files):
+    calls = []
+    build(files, calls).run()
+    calls.clear()
+    assert build(files, calls).run() == []
+    files["out_b"].unlink()
+    assert build(files, calls).run() == ["b"]
+
+
+def test_pipeline_reruns_downstream_of_changed_input(files):
+    calls = []
+    build(files, calls).run()
+    calls.clear()
+    files["src"].write_text("bb")
+    assert sorted(build(files, calls).run()) == ["a", "b", "mid"]
+
+
+def test_pipeline_force_and_only(files):
+    calls = []
+    build(files, calls).run()
+    calls.clear()
+    assert build(files, calls).run(force=["a"], only=["a"]) == ["a"]
+    with pytest.raises(ValueError, match="Unknown stages"):
+        build(files, calls).run(only=["z"])
+
+
+def test_pipeline_runs_independent_stages_concurrently(files):
+    barrier = threading.Barrier(2, timeout=5)
+    calls = []
+    p = build(files, calls, max_workers=2)
+    for name in ["a", "b"]:
+        f = p.stages[name].func
+
+        def wrapped(f=f):
+            barrier.wait()
+            f()
+
+        p.stages[name].func = wrapped
+    p.run()
+    assert sorted(calls) == ["a", "b", "m"]
+
+
+def test_pipeline_serializes_stages_sharing_storage(tmp_path):
+    db = tmp_path.joinpath("test.db")
+    sqlite3.connect(db).close()
+    active = []
+    overlap = []
+
+    def write(table):
+        def f():
+            active.append(table)
+            overlap.append(len(active))
+            c = sqlite3.connect(db)
+            c.execute(f"CREATE TABLE {table} (x INTEGER)")
+            c.close()
+            active.remove(table)
+
+        return f
+
+    p = pl.Pipeline(
+        [
+            pl.Stage("a", write("a"), outputs=[pl.TableResource(db, "a")]),
+            pl.Stage("b", write("b"), outputs=[pl.TableResource(db, "b")]),
+        ],
+        tmp_path.joinpath("state.json"),
+        max_workers=2,
+    )
+    assert sorted(p.run()) == ["a", "b"]
+    assert max(overlap) == 1
+
+
+def test_pipeline_failure_does_not_record_stage(files):
+    calls = []
+    p = build(files, calls)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    p.stages["a"].func = fail
+    with pytest.raises(RuntimeError):
+        p.run()
+    assert "a" not in p.load_state()
+    assert "mid" in p.load_state()
+
+
+def test_pipeline_rejects_cycles(files):
+    x, y = pl.FileResource(files["src"]), pl.FileResource(files["mid"])
+    with pytest.raises(ValueError, match="cycle"):
+        pl.Pipeline(
+            [pl.Stage("a", print, [x], [y]), pl.Stage("b", print, [y], [x])],
+            files["state"],
+        )
+
+
+def test_table_and_schema_fingerprints(tmp_path):
+    db = tmp_path.joinpath("test.db")
+    t = pl.TableResource(db, "t")
+    s = pl.SchemaResource(db, ["t"])
+    assert not t.exists() and t.fingerprint() is None
+    c = sqlite3.connect(db)
+    c.execute("CREATE TABLE t (x INTEGER)")
+    c.commit()
+    t_fp, s_fp = t.fingerprint(), s.fingerprint()
+    c.execute("INSERT INTO t VALUES (1)")
+    c.commit()
+    c.close()
+    assert t.fingerprint() != t_fp
+    assert s.fingerprint() == s_fp
+
+
+def test_pipeline_reruns_consumers_of_rewritten_table(tmp_path):
+    db = tmp_path.joinpath("test.db")
+    src, out = tmp_path.joinpath("src.txt"), tmp_path.joinpath("out.txt")
+    src.write_text("1")
+
+    def write():
+        # Rebuilt from scratch with the same # of rows, so the table's
+        # fingerprint doesn't change.
+        c = sqlite3.connect(db)
+        c.execute("DROP TABLE IF EXISTS t")
+        c.execute("CREATE TABLE t (x INTEGER)")
+        c.execute("INSERT INTO t VALUES (?)", (int(src.read_text()),))
+        c.commit()
+        c.close()
+
+    def read():
+        c = sqlite3.connect(db)
+        out.write_text(str(c.execute("SELECT x FROM t").fetchone()[0]))
+        c.close()
+
+    def build():
+        t = pl.TableResource(db, "t")
+        return pl.Pipeline(
+            [
+                pl.Stage("a", write, outputs=[t]),
+                pl.Stage("b", read, [t], [pl.FileResource(out)]),
+            ],
+            tmp_path.joinpath("state.json"),
+        )
+
+    assert build().run() == ["a", "b"]
+    src.write_text("2")
+    assert build().run(force=["a"], only=["a"]) == ["a"]
+    assert build().run(only=["b"]) == ["b"]
+    assert out.read_text() == "2"
+    assert build().run() == []
+
+
+def test_pipeline_does_not_write_storage_being_read(tmp_path):
+    db = tmp_path.joinpath("test.db")
+    c = sqlite3.connect(db)
+    c.execute("CREATE TABLE src (x INTEGER)")
+    c.commit()
+    c.close()
+    out = tmp_path.joinpath("out.txt")
+    active = []
+    overlap = []
+
+    def run(name, sql):
+        def f():
+            active.append(name)
+            overlap.append(len(active))
+            c = sqlite3.connect(db)
+            c.execute(sql)
+            time.sleep(0.05)
+            c.commit()
+            c.close()
+            if name == "read":
+                out.touch()
+            active.remove(name)
+
+        return f
+
+    src = pl.TableResource(db, "src")
+    p = pl.Pipeline(
+        [
+            pl.Stage(
+                "read",
+                run("read", "SELECT * FROM src"),
+                [src],
+                [pl.FileResource(out)],
+            ),
+            pl.Stage(
+                "write",
+                run("write", "CREATE TABLE t (x INTEGER)"),
+                outputs=[pl.TableResource(db, "t")],
+            ),
+        ],
+        tmp_path.joinpath("state.json"),
+        max_workers=2,
+    )
+    assert sorted(p.run()) == ["read", "write"]
+    assert max(overlap) == 1
@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+pytest.importorskip("datagenius")
+
+from gen_db.prepdata import PrepData, CHECKPOINTS
+from vanguard.db import constants
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path.joinpath('datasets.db')}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def chunk():
+    return pd.DataFrame(
+        dict(blockgeoid=[1, 1, 2], totalpop=[5, 5, 6], is_donor=[1, 0, 1])
+    )
+
+
+def test_write_chunk_is_exactly_once(engine, chunk):
+    p = PrepData(lambda df, md: (df, md), aggregate_cenblocks=True)
+    p.load_checkpoints(engine, "oh_dist4")
+    assert p.write_chunk(engine, "oh_dist4", chunk, 1, 0, 3)
+    assert not p.write_chunk(engine, "oh_dist4", chunk, 1, 0, 3)
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT COUNT(*) FROM oh_dist4")).scalar() == 3
+        assert (
+            conn.execute(sa.text(f"SELECT COUNT(*) FROM {CHECKPOINTS}")).scalar() == 1
+        )
+
+
+def test_load_checkpoints(engine, chunk):
+    p = PrepData(lambda df, md: (df, md), manual_header=["a"], aggregate_cenblocks=True)
+    p.load_checkpoints(engine, "oh_dist4")
+    p.write_chunk(engine, "oh_dist4", chunk, 1, 0, 3)
+    p.write_chunk(engine, "oh_dist4", chunk, 2, 3, 6)
+    resumed = PrepData(lambda df, md: (df, md), aggregate_cenblocks=True)
+    resumed.load_checkpoints(engine, "oh_dist4")
+    assert resumed._header == ["a"]
+    assert resumed._next_chunk(3) == (3, True)
+    assert resumed._next_chunk(6) == (100000, False)
+    aggs = resumed._aggregator.to_frame()
+    assert aggs["total_donors"].tolist() == [2, 2]
+
+
+def test_next_chunk_lines_up_with_checkpoints(engine, chunk):
+    p = PrepData(lambda df, md: (df, md), batch_size=4)
+    p.load_checkpoints(engine, "oh_dist4")
+    p.write_chunk(engine, "oh_dist4", chunk, 2, 3, 6)
+    assert p._next_chunk(0) == (3, False)
+    assert p._next_chunk(3) == (3, True)
+    assert not p.write_chunk(engine, "oh_dist4", chunk, 1, 2, 5)
+
+
+def test_execute_only_reloads_chunks_written_elsewhere(engine, chunk, monkeypatch):
+    monkeypatch.setattr(constants, "SQL_ALCHEMY_SIMDB", str(engine.url))
+    p = PrepData(lambda df, md: (df, md), aggregate_cenblocks=True)
+    loads = []
+    load = p.load_checkpoints
+    monkeypatch.setattr(p, "load_checkpoints", lambda *a: loads.append(load(*a)))
+
+    def written(elsewhere):
+        def f(engine, file_name, col_map):
+            p.write_chunk(engine, file_name, chunk, 1, 0, 3)
+            return elsewhere
+
+        return f
+
+    monkeypatch.setattr(p, "_execute", written(False))
+    p.execute("oh_dist4", write_cenblocks=False)
+    assert len(loads) == 1
+    with engine.connect() as conn:
+        assert not sa.inspect(conn).has_table("cenblocks")
+    monkeypatch.setattr(p, "_execute", written(True))
+    p.execute("oh_dist4")
+    assert len(loads) == 3
+    with engine.connect() as conn:
+        total = conn.execute(sa.text("SELECT SUM(total_donors) FROM cenblocks"))
+        assert total.scalar() == 2
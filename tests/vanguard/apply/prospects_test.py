@@ -0,0 +1,105 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from vanguard.apply import prospects
+from vanguard.db import models, constants
+from vanguard.db.ratings import RatingLookup
+
+
+@pytest.fixture
+def sim_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "RATINGS_VERSION", tmp_path.joinpath("version"))
+    db = tmp_path.joinpath("datasets.db")
+    engine = create_engine(f"sqlite:///{db}")
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(engine)()
+    s.add_all(
+        [
+            models.CenblockRating(blockgeoid=10, rating=0.5),
+            models.Voter(ohvfid="001", blockgeoid=10, party_affiliation="D", total=5),
+            models.Voter(ohvfid="002", blockgeoid=20, party_affiliation="R", total=0),
+        ]
+    )
+    s.commit()
+    yield db, s
+    s.close()
+
+
+class FakeModel:
+    def __init__(self):
+        self.requests = []
+
+    def post(self, url, data):
+        examples = json.loads(data)["examples"]
+        self.requests.append(examples)
+        results = [x["total"] / 10 for x in examples]
+        return SimpleNamespace(json=lambda: dict(results=results))
+
+
+class FakeConsumer:
+    def __init__(self, events):
+        self.events = list(events)
+
+    def poll(self, timeout_ms, max_records):
+        records = [
+            SimpleNamespace(value=json.dumps(e).encode("utf-8"), timestamp=None)
+            for e in self.events[:max_records]
+        ]
+        self.events = self.events[max_records:]
+        return {"incoming_calls": records} if records else dict()
+
+
+def test_feature_cache(sim_db):
+    db, s = sim_db
+    cache = prospects.FeatureCache(s, RatingLookup(db), max_size=1)
+    rows = cache.get_many(["001", "003", "001"])
+    assert rows[0]["party_affiliation"] == "D"
+    assert rows[0]["cenblock_rating"] == 0.5
+    assert rows[1] is None
+    # A voter that repeats within a batch is only looked up once.
+    assert cache.misses == 2 and cache.hits == 0
+    assert cache.get_many(["002"])[0]["cenblock_rating"] is None
+    assert list(cache._cache) == ["002"]
+    assert cache.get_many(["002", "002"])[0]["total"] == 0
+    assert cache.misses == 3 and cache.hits == 1
+
+
+def test_feature_cache_batch_larger_than_cache(sim_db):
+    db, s = sim_db
+    cache = prospects.FeatureCache(s, RatingLookup(db), max_size=1)
+    rows = cache.get_many(["001", "002"])
+    assert [r["party_affiliation"] for r in rows] == ["D", "R"]
+    assert list(cache._cache) == ["002"]
+
+
+def test_micro_batches():
+    events = [dict(ohvfid=f"00{i}", call_result=0) for i in range(5)]
+    batches = prospects.micro_batches(FakeConsumer(events), window=0, max_batch=2)
+    assert [len(next(batches)) for _ in range(3)] == [2, 2, 1]
+
+
+def test_score_batch(sim_db):
+    db, s = sim_db
+    model = FakeModel()
+    published = []
+    scorer = prospects.ProspectScorer(
+        prospects.FeatureCache(s, RatingLookup(db)), published.extend, http=model
+    )
+    batch = [(dict(ohvfid=o, call_result=0), 0.0) for o in ["001", "002", "001", "999"]]
+    scores = scorer.score_batch(batch)
+    assert len(model.requests) == 1
+    assert [(x["ohvfid"], x["score"]) for x in scores] == [("001", 0.5), ("002", 0.0)]
+    assert published == scores
+    assert scorer.unknown == 1
+    assert scorer.latency.count == 2
+    assert scorer.latency.p99 >= scorer.latency.p50 > 0
+
+
+def test_table_sink(sim_db):
+    _, s = sim_db
+    prospects.table_sink(s)([dict(ohvfid="001", score=0.5, scored_at=1.0)])
+    assert s.query(models.ProspectScore).one().score == 0.5
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from vanguard.apply import serving
+from vanguard.apply.cenblocks import rate_cenblocks
+from vanguard.db import models, constants
+
+
+@pytest.fixture
+def model():
+    return serving.LinearModel(["total", "party_affiliation=D"], [0.1, 1.0], 0.5)
+
+
+@pytest.fixture
+def server(model):
+    s = serving.StandInServer(("127.0.0.1", 0), dict(prospects=model), seed=0)
+    s.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+@pytest.fixture
+def ratings_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "RATINGS_VERSION", tmp_path.joinpath("version"))
+
+
+def test_linear_model(model, tmp_path):
+    examples = [dict(total=10, party_affiliation="D"), dict(party_affiliation="R")]
+    assert model.predict(examples).tolist() == [2.5, 0.5]
+    for name in ["weights.json", "weights.npz"]:
+        model.save(tmp_path.joinpath(name))
+        loaded = serving.LinearModel.load(tmp_path.joinpath(name))
+        assert loaded.features == model.features
+        assert loaded.predict(examples).tolist() == [2.5, 0.5]
+    with pytest.raises(ValueError):
+        serving.LinearModel(["a"], [1, 2])
+
+
+def test_regress(server):
+    url = f"{server.url}/prospects:regress"
+    body = dict(examples=[dict(total=10, party_affiliation="D")])
+    r = requests.post(url, data=json.dumps(body))
+    assert r.json() == dict(results=[2.5])
+    assert requests.get(f"{server.url}/prospects").status_code == 200
+    r = requests.post(f"{server.url}/missing:regress", data=json.dumps(body))
+    assert r.status_code == 404 and "error" in r.json()
+    r = requests.post(url, data="not json")
+    assert r.status_code == 400 and "error" in r.json()
+
+
+def test_error_injection(server):
+    server.error_rate = 1.0
+    r = requests.post(
+        f"{server.url}/prospects:regress", data=json.dumps(dict(examples=[]))
+    )
+    assert r.status_code == 503 and "results" not in r.json()
+
+
+def test_rate_cenblocks(ratings_version):
+    features = serving.cenblocks_features()
+    model = serving.LinearModel(features, [0.0] * len(features), 0.25)
+    server = serving.StandInServer(("127.0.0.1", 0), dict(cenblocks=model))
+    server.start()
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(engine)()
+    s.add_all([models.CensusBlock(blockgeoid=i, totalpop=10) for i in range(3)])
+    s.commit()
+    try:
+        assert rate_cenblocks(s, f"{server.url}/cenblocks:regress")
+        ratings = s.query(models.CenblockRating.rating).all()
+        assert ratings == [(0.25,)] * 3
+    finally:
+        s.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_benchmark_rating():
+    r = serving.benchmark_rating(n_blocks=50, repeats=2)
+    assert r["best"] <= r["median"]
+    assert r["blocks_per_sec"] > 0
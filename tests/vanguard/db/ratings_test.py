@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from vanguard.db import models, constants, util as u
+from vanguard.db.ratings import RatingLookup
+
+
+@pytest.fixture
+def sim_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "RATINGS_VERSION", tmp_path.joinpath("version"))
+    db = tmp_path.joinpath("datasets.db")
+    engine = create_engine(f"sqlite:///{db}")
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(engine)()
+    s.add_all(
+        [
+            models.CenblockRating(blockgeoid=30, rating=0.3),
+            models.CenblockRating(blockgeoid=10, rating=0.1),
+            models.CenblockRating(blockgeoid=20, rating=0.2),
+            models.CenblockRating(blockgeoid=10, rating=0.15),
+            models.Voter(ohvfid="002", blockgeoid=20),
+            models.Voter(ohvfid="001", blockgeoid=10),
+            models.Voter(ohvfid="003", blockgeoid=40),
+        ]
+    )
+    s.commit()
+    yield db, s
+    s.close()
+
+
+def test_rating_lookup(sim_db):
+    db, _ = sim_db
+    lookup = RatingLookup(db)
+    assert len(lookup) == 3
+    assert lookup.rating(10) == 0.15
+    assert lookup.rating(20) == 0.2
+    assert lookup.rating(99) is None
+    result = lookup.ratings([30, 5, 10, 99])
+    assert result[[0, 2]].tolist() == [0.3, 0.15]
+    assert np.isnan(result[[1, 3]]).all()
+    with pytest.raises(ValueError):
+        lookup.voter_ratings(["001"])
+
+
+def test_rating_lookup_w_voters(sim_db):
+    db, _ = sim_db
+    lookup = RatingLookup(db, with_voters=True)
+    assert lookup.voter_blockgeoids(["003", "001", "0011"]).tolist() == [40, 10, -1]
+    assert lookup.voter_rating("002") == 0.2
+    assert lookup.voter_rating("003") is None
+
+
+def test_rating_lookup_reloads(sim_db):
+    db, s = sim_db
+    lookup = RatingLookup(db, reload_interval=0)
+    s.add(models.CenblockRating(blockgeoid=20, rating=0.5))
+    s.commit()
+    assert lookup.rating(20) == 0.2
+    u.touch_ratings_version()
+    assert lookup.rating(20) == 0.5
+    assert not lookup.maybe_reload()
+
+
+def test_rating_lookup_snapshot(sim_db, tmp_path):
+    db, _ = sim_db
+    RatingLookup(db, with_voters=True).save_snapshot(tmp_path.joinpath("snap"))
+    lookup = RatingLookup.from_snapshot(tmp_path.joinpath("snap"))
+    assert isinstance(lookup._arrays.geoids, np.memmap)
+    assert lookup.voter_rating("001") == 0.15
+    assert lookup.ratings([20]).tolist() == [0.2]
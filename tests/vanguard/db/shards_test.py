@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from gen_db import lib
+from vanguard.db import models, constants, shards, util as u
+
+GEOIDS = [390350001001000, 390350001001001, 390490002002000, 390610003003000]
+
+
+@pytest.fixture
+def shard_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "SHARDS", tmp_path)
+    src = tmp_path.joinpath("src.db")
+    conn = sqlite3.connect(src)
+    conn.execute("CREATE TABLE raw (ohvfid TEXT, blockgeoid INTEGER, totalpop INTEGER)")
+    conn.executemany(
+        "INSERT INTO raw VALUES (?, ?, ?)",
+        [(f"00{i}", g, 10 * i) for i, g in enumerate(GEOIDS)],
+    )
+    conn.commit()
+    conn.close()
+    for i in range(3):
+        engine = create_engine(f"sqlite:///{shards.shard_path(i)}")
+        models.Base.metadata.create_all(engine)
+        engine.dispose()
+        conn = sqlite3.connect(shards.shard_path(i))
+        conn.execute(f"ATTACH DATABASE '{src}' AS src")
+        source = shards.gen_shard_source("src.raw", i, 3)
+        conn.execute(
+            f"INSERT INTO voters (ohvfid, blockgeoid) "
+            f"SELECT ohvfid, blockgeoid FROM {source}"
+        )
+        conn.execute(
+            "INSERT INTO cenblocks (blockgeoid, totalpop) "
+            + lib.gen_select(source, ["blockgeoid", "MAX(totalpop)"], ["blockgeoid"])
+        )
+        conn.commit()
+        conn.close()
+    return tmp_path
+
+
+def test_shard_of_matches_shard_expr():
+    conn = sqlite3.connect(":memory:")
+    for g in GEOIDS + [None]:
+        for n in [1, 2, 3, 8]:
+            r = conn.execute(f"SELECT {shards.gen_shard_expr(n, '?')}", (g,))
+            assert r.fetchone()[0] == shards.shard_of(g, n)
+    conn.close()
+
+
+def test_shard_of_keeps_counties_together():
+    assert shards.shard_of(GEOIDS[0], 8) == shards.shard_of(GEOIDS[1], 8)
+    assert len({shards.shard_of(c * 10**10, 4) for c in range(39001, 39200, 2)}) == 4
+
+
+def test_query_shards(shard_dir):
+    df = shards.query_shards("SELECT ohvfid FROM voters", 3)
+    assert sorted(df["ohvfid"].tolist()) == ["000", "001", "002", "003"]
+    df = shards.query_shards("SELECT COUNT(*) AS ct FROM voters", 3)
+    assert len(df) == 3
+    assert df["ct"].sum() == 4
+
+
+def test_create_sharded_engine(shard_dir):
+    session = u.connect_to_sim_db(shards.create_sharded_engine(3))
+    try:
+        assert session.query(models.Voter).count() == 4
+        assert session.query(models.CensusBlock).count() == 4
+    finally:
+        session.close()
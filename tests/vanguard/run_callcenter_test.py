@@ -1,3 +1,6 @@
+import json
+
+import pandas as pd
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -37,3 +40,65 @@ def test_call_stream_generator(test_db):
     a = next(x)
     assert len(a) == 1
     assert a[0].ohvfid == "002"
+
+
+class FakeProducer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, topic, value):
+        self.sent.append((topic, json.loads(value)))
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def voter_db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(engine)()
+    # Gaps in the ids, as after voters have been deleted.
+    s.add_all(
+        [models.Voter(id=i * 3, ohvfid=f"{i:03d}", is_donor=i % 2) for i in range(1, 8)]
+    )
+    s.commit()
+    yield s
+    s.close()
+
+
+def test_voter_batches(voter_db):
+    batches = list(run.voter_batches(voter_db, ["ohvfid"], 3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    assert pd.concat(batches)["ohvfid"].tolist() == [f"{i:03d}" for i in range(1, 8)]
+    batches = list(run.voter_batches(voter_db, ["ohvfid"], 3, num_samples=4))
+    assert [len(b) for b in batches] == [3, 1]
+
+
+def test_simulated_call_generator(voter_db):
+    a = list(run.simulated_call_generator(voter_db, 2, pos_resp_rate=0.5, seed=1))
+    b = list(run.simulated_call_generator(voter_db, 2, pos_resp_rate=0.5, seed=1))
+    calls = [c for batch in a for c in batch]
+    assert [c["ohvfid"] for c in calls] == [f"{i:03d}" for i in range(1, 8)]
+    assert {c["call_result"] for c in calls} <= {0, 1}
+    assert [len(batch) for batch in a] == [2, 2, 2, 1]
+    assert a == b
+
+
+def test_stream_simulated_calls(voter_db):
+    producer = FakeProducer()
+    sent = run.stream_simulated_calls(
+        voter_db, 3, secs_btw=0, producer=producer, num_samples=5, seed=0
+    )
+    assert sent == 5
+    assert [t for t, _ in producer.sent] == ["incoming_calls"] * 5
+    assert voter_db.query(models.Call).count() == 0
+
+    producer = FakeProducer()
+    run.stream_simulated_calls(
+        voter_db, 3, secs_btw=0, persist=True, producer=producer, seed=0
+    )
+    calls = voter_db.query(models.Call).order_by(models.Call.id).all()
+    assert [dict(ohvfid=c.ohvfid, call_result=c.call_result) for c in calls] == [
+        v for _, v in producer.sent
+    ]
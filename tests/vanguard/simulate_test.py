@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vanguard import simulate
+
+
+def test_response_probabilities():
+    df = pd.DataFrame(dict(rating=[0.1, 0.3, None, 0.2], is_donor=[0, 0, 0, 1]))
+    probs = simulate.response_probabilities(df, 0.1, donor_lift=1.0)
+    assert probs.mean() == pytest.approx(0.1)
+    assert probs[1] == pytest.approx(3 * probs[0])
+    assert probs[2] == pytest.approx(2 * probs[0])
+    assert probs[3] == pytest.approx(4 * probs[0])
+    probs = simulate.response_probabilities(df[["is_donor"]], 0.5, donor_lift=0.0)
+    assert probs.tolist() == [0.5] * 4
+
+
+def test_simulate_call_results():
+    rng = np.random.default_rng(0)
+    result = simulate.simulate_call_results(rng, 1000, 0.1)
+    assert result.sum() == 100
+    result = simulate.simulate_call_results(rng, 4, probs=np.array([0, 1, 0, 1]))
+    assert result.tolist() == [0, 1, 0, 1]
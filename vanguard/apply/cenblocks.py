@@ -3,33 +3,56 @@ import json
 
 import pandas as pd
 import sqlalchemy as sa
+from sqlalchemy.orm import Session
 
 from ..db import constants, util as u, models
 
 
-if __name__ == "__main__":
-    engine = sa.create_engine(
-        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
-    )
-    session = u.connect_to_sim_db(engine)
+def rate_cenblocks(
+    session: Session,
+    url: str = "http://localhost:8501/v1/models/cenblocks:regress",
+    notify: bool = True,
+) -> bool:
+    """
+    Scores every census block with the served cenblocks model and adds
+    the results to the cenblock_ratings table.
+
+    Args:
+        session (Session): A SQLAlchemy Session object.
+        url (str): The cenblocks model's TF Serving regress endpoint.
+        notify (bool): If True, RatingLookups are told to reload once
+            the ratings are written. Default is True.
+    Returns:
+        bool: True if the ratings were written, False if the model
+            returned an error (which is printed).
+    """
     query = session.query(models.CensusBlock)
     df = pd.read_sql(query.statement, session.bind)
     df["totalpop"] = df["totalpop"].astype(int)
-    url = "http://localhost:8501/v1/models/cenblocks:regress"
     data = df.to_dict("records")
     j = dict(examples=data)
     r = requests.post(url, data=json.dumps(j))
-    if "results" in r.json().keys():
-        df["rating"] = pd.Series(r.json()["results"])
-        df["cenblock_rating"] = df.apply(
-            lambda row: models.CenblockRating(
-                blockgeoid=row["blockgeoid"], rating=row["rating"]
-            ),
-            axis=1
-        )
-        session.add_all(df["cenblock_rating"].values.tolist())
-        session.commit()
-    else:
+    if "results" not in r.json().keys():
         print(r.json())
+        return False
+    df["rating"] = pd.Series(r.json()["results"])
+    df["cenblock_rating"] = df.apply(
+        lambda row: models.CenblockRating(
+            blockgeoid=row["blockgeoid"], rating=row["rating"]
+        ),
+        axis=1,
+    )
+    session.add_all(df["cenblock_rating"].values.tolist())
+    session.commit()
+    if notify:
+        u.touch_ratings_version()
+    return True
+
+
+if __name__ == "__main__":
+    engine = sa.create_engine(
+        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
+    )
+    session = u.connect_to_sim_db(engine)
+    rate_cenblocks(session)
     session.close()
-    
\ No newline at end of file
@@ -0,0 +1,328 @@
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from ..db import constants, util as u, models
+from ..db.ratings import RatingLookup
+
+# The voter columns the prospects model is trained on (see
+# datastore/prospect_train_data.sql), other than cenblock_rating.
+FEATURES = ["party_affiliation", "total", "avg", "days_since", "is_donor"]
+
+
+class FeatureCache:
+    """
+    An LRU cache of prospect model features keyed by ohvfid. Voters that
+    aren't cached are loaded from the voters table in one query per
+    lookup, and each voter's cenblock_rating comes from a RatingLookup
+    at lookup time, so cached voters pick up new ratings.
+
+    Args:
+        session (Session): A SQLAlchemy Session object.
+        ratings (RatingLookup, optional): The census block ratings.
+            Defaults to None, which loads them from the simulated
+            database.
+        max_size (int): The maximum # of voters to cache. Default is
+            1,000,000.
+    """
+
+    def __init__(
+        self, session: Session, ratings: RatingLookup = None, max_size: int = 1000000
+    ):
+        self.session = session
+        self.ratings = ratings or RatingLookup()
+        self.max_size = max_size
+        self._cache: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, ohvfids: List[str], batch_size: int = 500) -> None:
+        cols = [getattr(models.Voter, c) for c in ["ohvfid", "blockgeoid"] + FEATURES]
+        for i in range(0, len(ohvfids), batch_size):
+            q = self.session.query(*cols).filter(
+                models.Voter.ohvfid.in_(ohvfids[i : i + batch_size])
+            )
+            for r in q:
+                self._cache[r.ohvfid] = r._asdict()
+
+    def get_many(self, ohvfids: List[str]) -> List[Optional[dict]]:
+        """
+        Args:
+            ohvfids (List[str]): The voters to look up.
+        Returns:
+            List[Optional[dict]]: The features of each voter, in the
+                format the prospects model expects, or None if the voter
+                is unknown.
+        """
+        unique = list(dict.fromkeys(ohvfids))
+        misses = [o for o in unique if o not in self._cache]
+        self.misses += len(misses)
+        self.hits += len(unique) - len(misses)
+        if misses:
+            self._load(misses)
+        rows = [self._cache.get(o) for o in ohvfids]
+        for o in unique:
+            if o in self._cache:
+                self._cache.move_to_end(o)
+        # Only evict once the batch's rows are collected, so a batch with
+        # more voters than max_size still finds all of them.
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        found = [r for r in rows if r is not None]
+        ratings = self.ratings.ratings([r["blockgeoid"] or -1 for r in found])
+        out = []
+        rating = iter(ratings)
+        for r in rows:
+            if r is None:
+                out.append(None)
+            else:
+                x = {k: r[k] for k in FEATURES}
+                rt = next(rating)
+                x["cenblock_rating"] = None if np.isnan(rt) else float(rt)
+                out.append(x)
+        return out
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent latencies, in seconds, for reporting
+    percentiles.
+
+    Args:
+        window (int): The # of latencies to keep. Default is 10,000.
+    """
+
+    def __init__(self, window: int = 10000):
+        self._latencies = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, latencies: Iterable[float]) -> None:
+        for x in latencies:
+            self._latencies.append(x)
+            self.count += 1
+
+    def percentile(self, q: float) -> float:
+        if not self._latencies:
+            return math.nan
+        return float(np.percentile(self._latencies, q))
+
+    @property
+    def p50(self) -> float:
+        return self.percentile(50)
+
+    @property
+    def p99(self) -> float:
+        return self.percentile(99)
+
+
+def micro_batches(
+    consumer, window: float = 0.05, max_batch: int = 500
+) -> Iterator[List[Tuple[dict, float]]]:
+    """
+    Groups the call events from a KafkaConsumer into micro-batches.
+
+    Args:
+        consumer (KafkaConsumer): A consumer subscribed to the calls
+            topic, with JSON-encoded values.
+        window (float): The most time, in seconds, to wait for a batch
+            to fill after its first event arrives. Default is 0.05.
+        max_batch (int): The maximum # of events in a batch. Default is
+            500.
+    Yields:
+        List[Tuple[dict, float]]: The events in each batch, each with
+            the time.time() at which it was produced.
+    """
+    while True:
+        batch = []
+        deadline = None
+        while len(batch) < max_batch:
+            if deadline is None:
+                timeout = 1000
+            else:
+                timeout = int((deadline - time.monotonic()) * 1000)
+                if timeout <= 0:
+                    break
+            polled = consumer.poll(
+                timeout_ms=timeout, max_records=max_batch - len(batch)
+            )
+            for records in polled.values():
+                for r in records:
+                    produced = r.timestamp / 1000 if r.timestamp else time.time()
+                    batch.append((json.loads(r.value), produced))
+            if batch and deadline is None:
+                deadline = time.monotonic() + window
+        if batch:
+            yield batch
+
+
+def kafka_sink(producer, topic: str = "prospect_scores") -> Callable:
+    """
+    Args:
+        producer (KafkaProducer): The producer to publish with.
+        topic (str): The topic to publish to. Default is prospect_scores.
+    Returns:
+        Callable: A sink for ProspectScorer that publishes each score as
+            JSON to topic.
+    """
+
+    def publish(scores: List[dict]) -> None:
+        for s in scores:
+            producer.send(topic, json.dumps(s).encode("utf-8"))
+        producer.flush()
+
+    return publish
+
+
+def table_sink(session: Session) -> Callable:
+    """
+    Args:
+        session (Session): A SQLAlchemy Session object.
+    Returns:
+        Callable: A sink for ProspectScorer that adds the scores to the
+            prospect_scores table.
+    """
+
+    def publish(scores: List[dict]) -> None:
+        session.bulk_insert_mappings(models.ProspectScore, scores)
+        session.commit()
+
+    return publish
+
+
+class ProspectScorer:
+    """
+    Scores voters with the served prospects model as their calls come
+    in. Each micro-batch of calls is scored with a single request to the
+    model, and the scores are passed to sink.
+
+    Args:
+        features (FeatureCache): Where to get the voters' features.
+        sink (Callable): Called with each batch of scores, as a list of
+            dicts with ohvfid, score and scored_at keys.
+        url (str): The prospects model's TF Serving regress endpoint.
+        http (requests.Session, optional): The HTTP session to call the
+            model with. Defaults to None, which creates one, so that
+            connections are reused between batches.
+    """
+
+    def __init__(
+        self,
+        features: FeatureCache,
+        sink: Callable,
+        url: str = "http://localhost:8501/v1/models/prospects:regress",
+        http: requests.Session = None,
+    ):
+        self.features = features
+        self.sink = sink
+        self.url = url
+        self.http = http or requests.Session()
+        self.latency = LatencyTracker()
+        self.unknown = 0
+
+    def score_batch(self, batch: List[Tuple[dict, float]]) -> List[dict]:
+        """
+        Args:
+            batch (List[Tuple[dict, float]]): Call events and the times
+                they were produced, as yielded by micro_batches.
+        Returns:
+            List[dict]: The scores that were published. Calls from
+                unknown voters are skipped.
+        """
+        ohvfids: Dict[str, float] = dict()
+        for event, produced in batch:
+            # Score each voter once per batch, timed from their first call.
+            ohvfids.setdefault(event["ohvfid"], produced)
+        rows = self.features.get_many(list(ohvfids))
+        known = [(o, x) for o, x in zip(ohvfids, rows) if x is not None]
+        self.unknown += len(ohvfids) - len(known)
+        if not known:
+            return []
+        r = self.http.post(
+            self.url, data=json.dumps(dict(examples=[x for _, x in known]))
+        )
+        results = r.json().get("results")
+        if results is None:
+            raise RuntimeError(f"The prospects model returned an error: {r.json()}")
+        now = time.time()
+        scores = [
+            dict(ohvfid=o, score=float(s), scored_at=now)
+            for (o, _), s in zip(known, results)
+        ]
+        self.sink(scores)
+        self.latency.add(now - ohvfids[s["ohvfid"]] for s in scores)
+        return scores
+
+    def run(
+        self, consumer, window: float = 0.05, max_batch: int = 500, report: int = 100
+    ):
+        """
+        Scores calls from consumer until interrupted.
+
+        Args:
+            consumer (KafkaConsumer): See micro_batches.
+            window (float): See micro_batches.
+            max_batch (int): See micro_batches.
+            report (int): Print latency percentiles every report
+                batches. Default is 100.
+        """
+        for i, batch in enumerate(micro_batches(consumer, window, max_batch), 1):
+            self.score_batch(batch)
+            if i % report == 0:
+                print(
+                    f"Scored {self.latency.count} voters. "
+                    f"p50={self.latency.p50 * 1000:.1f}ms "
+                    f"p99={self.latency.p99 * 1000:.1f}ms "
+                    f"cache hits={self.features.hits} "
+                    f"unknown voters={self.unknown}"
+                )
+
+
+def consume_calls(
+    topic: str = "incoming_calls",
+    output: str = "prospect_scores",
+    to_table: bool = False,
+    window: float = 0.05,
+    max_batch: int = 500,
+    url: str = "http://localhost:8501/v1/models/prospects:regress",
+):
+    """
+    Scores the voters in incoming calls in real time.
+
+    Args:
+        topic (str): The topic to consume calls from.
+        output (str): The topic to publish scores to.
+        to_table (bool): If True, scores are written to the
+            prospect_scores table instead of the output topic.
+        window (float): See micro_batches.
+        max_batch (int): See micro_batches.
+        url (str): The prospects model's TF Serving regress endpoint.
+    """
+    from kafka import KafkaConsumer, KafkaProducer
+
+    engine = sa.create_engine(
+        constants.SQL_ALCHEMY_SIMDB, connect_args=dict(check_same_thread=False)
+    )
+    session = u.connect_to_sim_db(engine)
+    consumer = KafkaConsumer(topic, bootstrap_servers="kafka:9092")
+    try:
+        if to_table:
+            models.ProspectScore.__table__.create(engine, checkfirst=True)
+            sink = table_sink(session)
+        else:
+            sink = kafka_sink(KafkaProducer(bootstrap_servers="kafka:9092"), output)
+        scorer = ProspectScorer(FeatureCache(session), sink, url)
+        scorer.run(consumer, window, max_batch)
+    finally:
+        consumer.close()
+        session.close()
+
+
+if __name__ == "__main__":
+    consume_calls()
@@ -0,0 +1,353 @@
+import json
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+
+from ..db import util as u, models
+from .cenblocks import rate_cenblocks
+
+
+class LinearModel:
+    """
+    A linear regressor scored with NumPy, standing in for a model served
+    by TF Serving. Numeric features are used as is (missing values count
+    as 0). A feature named "column=value" is 1 when the example's column
+    equals value and 0 otherwise, for string columns like
+    party_affiliation.
+
+    Args:
+        features (Sequence[str]): The feature names.
+        weights (Sequence[float]): A weight for each feature.
+        bias (float): The intercept. Default is 0.
+    """
+
+    def __init__(self, features: Sequence[str], weights: Sequence[float], bias=0.0):
+        self.features = list(features)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        if len(self.features) != len(self.weights):
+            raise ValueError(
+                f"Got {len(self.weights)} weights for {len(self.features)} features."
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "LinearModel":
+        """
+        Args:
+            path (Path): A .json file with features, weights and bias
+                keys, or a .npz file with arrays of the same names, as
+                written by save.
+        Returns:
+            LinearModel: The model.
+        """
+        path = Path(path)
+        if path.suffix == ".npz":
+            with np.load(path) as w:
+                return cls(w["features"].tolist(), w["weights"], w["bias"])
+        with open(path) as r:
+            w = json.load(r)
+        return cls(w["features"], w["weights"], w.get("bias", 0.0))
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        if path.suffix == ".npz":
+            np.savez(
+                path,
+                features=np.array(self.features),
+                weights=self.weights,
+                bias=self.bias,
+            )
+        else:
+            with open(path, "w") as w:
+                json.dump(
+                    dict(
+                        features=self.features,
+                        weights=self.weights.tolist(),
+                        bias=self.bias,
+                    ),
+                    w,
+                )
+
+    @classmethod
+    def random(
+        cls, features: Sequence[str], seed: Optional[int] = None
+    ) -> "LinearModel":
+        """
+        Args:
+            features (Sequence[str]): The feature names.
+            seed (Optional[int], optional): A seed for the weights.
+        Returns:
+            LinearModel: A model with small random weights, for load
+                testing when no exported weights are at hand.
+        """
+        rng = np.random.default_rng(seed)
+        return cls(features, rng.normal(0, 0.01, len(features)), rng.random())
+
+    def matrix(self, examples: List[dict]) -> np.ndarray:
+        """
+        Args:
+            examples (List[dict]): The instances to score, as in the
+                examples of a :regress request.
+        Returns:
+            ndarray: An (examples x features) matrix.
+        """
+        x = np.zeros((len(examples), len(self.features)), dtype=np.float64)
+        for j, f in enumerate(self.features):
+            col, sep, value = f.partition("=")
+            v = [e.get(col) for e in examples]
+            if sep:
+                x[:, j] = [str(i) == value for i in v]
+            else:
+                x[:, j] = np.array(v, dtype=np.float64)
+        return np.nan_to_num(x, copy=False)
+
+    def predict(self, examples: List[dict]) -> np.ndarray:
+        return self.matrix(examples) @ self.weights + self.bias
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    A local HTTP server that speaks the TF Serving REST regress API
+    (POST /v1/models/<name>:regress with a JSON body of examples), for
+    running the rating and scoring clients without Docker or the real
+    models.
+
+    Args:
+        address (tuple): The (host, port) to listen on. Port 0 picks a
+            free port.
+        models (Dict[str, LinearModel]): The models to serve, by name.
+        latency (float): Seconds to wait before responding to each
+            request. Default is 0.
+        jitter (float): Up to this many more seconds are added to each
+            request's latency, at random. Default is 0.
+        error_rate (float): The share of requests to fail with a 503
+            and an error message. Default is 0.
+        seed (Optional[int], optional): A seed for the jitter and
+            errors. Default is None.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        models: Dict[str, LinearModel],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(address, _Handler)
+        self.models = models
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/models"
+
+    def draw(self) -> tuple:
+        """
+        Returns:
+            tuple: The injected delay for a request, in seconds, and
+                whether it should fail.
+        """
+        with self._rng_lock:
+            delay = self.latency + self.jitter * self._rng.random()
+            return delay, self._rng.random() < self.error_rate
+
+    def start(self) -> threading.Thread:
+        """
+        Serves requests on a background thread until shutdown is called.
+
+        Returns:
+            Thread: The thread.
+        """
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StandInServer
+    protocol_version = "HTTP/1.1"
+    path_re = re.compile(r"^/v1/models/([^/:]+)(?:/versions/\d+)?(?::(\w+))?$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _model(self) -> tuple:
+        m = self.path_re.match(self.path)
+        if m is None or m.group(1) not in self.server.models:
+            name = m.group(1) if m else self.path
+            self._respond(404, dict(error=f"Servable not found for request: {name}"))
+            return None, None
+        return self.server.models[m.group(1)], m.group(2)
+
+    def do_GET(self):
+        model, method = self._model()
+        if model is None:
+            return
+        self._respond(
+            200,
+            dict(
+                model_version_status=[
+                    dict(version="1", state="AVAILABLE", status=dict(error_code="OK"))
+                ]
+            ),
+        )
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        model, method = self._model()
+        if model is None:
+            return
+        delay, fail = self.server.draw()
+        if delay:
+            time.sleep(delay)
+        if method != "regress":
+            self._respond(400, dict(error=f"Unsupported method: {method}"))
+        elif fail:
+            self._respond(503, dict(error="Injected failure"))
+        else:
+            try:
+                examples = json.loads(body)["examples"]
+                results = model.predict(examples).tolist()
+            except (ValueError, KeyError, TypeError) as e:
+                self._respond(400, dict(error=f"Malformed request: {e}"))
+                return
+            self._respond(200, dict(results=results))
+
+
+def cenblocks_features() -> List[str]:
+    """
+    Returns:
+        List[str]: The cenblocks columns rate_cenblocks sends to the
+            cenblocks model, other than the id and blockgeoid.
+    """
+    return [
+        c for c in models.CensusBlock.gen_column_list() if c not in ("id", "blockgeoid")
+    ]
+
+
+def benchmark_rating(
+    n_blocks: int = 10000,
+    repeats: int = 3,
+    model: LinearModel = None,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    seed: Optional[int] = 0,
+) -> dict:
+    """
+    Measures end-to-end census block rating throughput: rate_cenblocks
+    reading n_blocks synthetic census blocks from a scratch SQLite
+    database, scoring them against a local StandInServer and writing the
+    ratings back.
+
+    Args:
+        n_blocks (int): The # of census blocks to rate. Default is
+            10,000.
+        repeats (int): The # of times to rate them. Default is 3.
+        model (LinearModel, optional): The cenblocks model to serve.
+            Defaults to None, which means random weights.
+        latency (float): See StandInServer.
+        jitter (float): See StandInServer.
+        seed (Optional[int], optional): A seed for the synthetic data,
+            model and jitter. Default is 0.
+    Returns:
+        dict: The best and median seconds per run, and the best census
+            blocks rated per second.
+    """
+    features = cenblocks_features()
+    model = model or LinearModel.random(features, seed)
+    rng = np.random.default_rng(seed)
+    server = StandInServer(
+        ("127.0.0.1", 0), dict(cenblocks=model), latency, jitter, seed=seed
+    )
+    server.start()
+    times = []
+    with tempfile.TemporaryDirectory() as d:
+        engine = sa.create_engine(f"sqlite:///{Path(d).joinpath('bench.db')}")
+        models.Base.metadata.create_all(engine)
+        data = rng.random((n_blocks, len(features)))
+        rows = [dict(zip(features, r)) for r in data.tolist()]
+        for i, r in enumerate(rows):
+            r["blockgeoid"] = i
+            r["totalpop"] = int(r["totalpop"] * 1000)
+        with engine.begin() as conn:
+            conn.execute(models.CensusBlock.__table__.insert(), rows)
+        session = u.connect_to_sim_db(engine)
+        try:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                url = f"{server.url}/cenblocks:regress"
+                if not rate_cenblocks(session, url, notify=False):
+                    raise RuntimeError("The stand-in cenblocks model failed.")
+                times.append(time.perf_counter() - start)
+        finally:
+            session.close()
+            engine.dispose()
+            server.shutdown()
+            server.server_close()
+    return dict(
+        best=min(times),
+        median=float(np.median(times)),
+        blocks_per_sec=n_blocks / min(times),
+    )
+
+
+def serve(
+    model_paths: Dict[str, Path],
+    host: str = "127.0.0.1",
+    port: int = 8501,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    seed: Optional[int] = None,
+):
+    """
+    Serves LinearModels on the TF Serving REST port until interrupted.
+
+    Args:
+        model_paths (Dict[str, Path]): The weights file of each model to
+            serve, by name. A model without a path gets random weights
+            for the cenblocks features.
+        host (str): The host to listen on.
+        port (int): The port to listen on. Default is TF Serving's 8501.
+        latency (float): See StandInServer.
+        jitter (float): See StandInServer.
+        error_rate (float): See StandInServer.
+        seed (Optional[int], optional): See StandInServer.
+    """
+    served = {
+        name: LinearModel.load(p) if p else LinearModel.random(cenblocks_features())
+        for name, p in model_paths.items()
+    }
+    server = StandInServer((host, port), served, latency, jitter, error_rate, seed)
+    print(f"Serving {', '.join(served)} at {server.url}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
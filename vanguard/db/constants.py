@@ -4,6 +4,10 @@ DSTORE = Path("datastore")
 TRAIN = DSTORE.joinpath("batch_train")
 RAW = DSTORE.joinpath("raw_data")
 SIM = DSTORE.joinpath("sim_db")
+SHARDS = SIM.joinpath("shards")
 
 SIMDB = f"{SIM.joinpath('datasets.db')}"
 SQL_ALCHEMY_SIMDB = f"sqlite:///{SIMDB}"
+# Touched whenever new census block ratings are written, so that
+# in-memory copies of them know to reload.
+RATINGS_VERSION = SIM.joinpath("cenblock_ratings.version")
@@ -122,7 +122,7 @@ class Voter(Base):
     __tablename__ = "voters"
 
     id = Column(Integer, primary_key=True)
-    ohvfid = Column(String)
+    ohvfid = Column(String, index=True)
     first_name = Column(String)
     middle_name = Column(String)
     last_name = Column(String)
@@ -153,6 +153,80 @@ class Voter(Base):
         return f"<Voter(id={self.id}, name={self.first_name} {self.last_name})>"
 
 
+class PartyCode(Base):
+    __tablename__ = "party_codes"
+
+    code = Column(Integer, primary_key=True)
+    value = Column(String, unique=True)
+
+
+class CityCode(Base):
+    __tablename__ = "city_codes"
+
+    code = Column(Integer, primary_key=True)
+    value = Column(String, unique=True)
+
+
+class StateCode(Base):
+    __tablename__ = "state_codes"
+
+    code = Column(Integer, primary_key=True)
+    value = Column(String, unique=True)
+
+
+class EncodedVoter(Base):
+    """
+    Normalized storage for the voters table. Low-cardinality strings are
+    replaced by integer codes from the lookup tables in code_columns,
+    and the raw donation and committee code strings are kept in the
+    voter_donations table so that analytical queries don't read them.
+    In normalized mode, voters is a view that decodes this table.
+    """
+
+    __tablename__ = "voters_encoded"
+
+    # Maps Voter columns to their lookup table and code column.
+    code_columns = dict(
+        party_affiliation=(PartyCode, "party_code"),
+        city=(CityCode, "city_code"),
+        state=(StateCode, "state_code"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    ohvfid = Column(String, index=True)
+    first_name = Column(String)
+    middle_name = Column(String)
+    last_name = Column(String)
+    suffix = Column(String)
+    party_code = Column(Integer)
+    street1 = Column(String)
+    street2 = Column(String)
+    city_code = Column(Integer)
+    state_code = Column(Integer)
+    zip = Column(Integer)
+    plus4 = Column(Integer)
+    blockgeoid = Column(Integer)
+    total = Column(Float)
+    avg = Column(Float)
+    days_since = Column(Integer)
+    is_donor = Column(Integer)
+
+    def __repr__(self):
+        return f"<EncodedVoter(id={self.id}, name={self.first_name} {self.last_name})>"
+
+
+class VoterDonations(Base):
+    __tablename__ = "voter_donations"
+
+    voter_id = Column(Integer, primary_key=True)
+    demdonationamounts = Column(String)
+    demcommitteecodes = Column(String)
+    repdonationamounts = Column(String)
+    repcommitteecodes = Column(String)
+    otherpartydonationamounts = Column(String)
+    otherpartycommitteecodes = Column(String)
+
+
 class Call(Base):
     __tablename__ = "calls"
 
@@ -162,19 +236,42 @@ class Call(Base):
 
 
 class District(Base):
+    """
+    District level rollups of the cenblocks and calls tables. Once
+    populated, triggers keep them up to date as those tables change.
+    """
+
     __tablename__ = "districts"
 
     id = Column(Integer, primary_key=True)
-    district_num = Column(Integer)
+    district_num = Column(Integer, unique=True)
     district = Column(String)
     totalpop = Column(Integer)
     total_donors = Column(Float)
     donation_total = Column(Float)
+    total_calls = Column(Integer)
+    positive_calls = Column(Integer)
+
+
+class CenblockDistrict(Base):
+    __tablename__ = "cenblock_districts"
+
+    blockgeoid = Column(Integer, primary_key=True)
+    district_num = Column(Integer)
 
 
 class CenblockRating(Base):
     __tablename__ = "cenblock_ratings"
 
     id = Column(Integer, primary_key=True)
-    blockgeoid = Column(Integer)
+    blockgeoid = Column(Integer, index=True)
     rating = Column(Float)
+
+
+class ProspectScore(Base):
+    __tablename__ = "prospect_scores"
+
+    id = Column(Integer, primary_key=True)
+    ohvfid = Column(String, index=True)
+    score = Column(Float)
+    scored_at = Column(Float)
@@ -0,0 +1,231 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from . import constants
+
+
+class _Arrays(NamedTuple):
+    geoids: np.ndarray
+    ratings: np.ndarray
+    ohvfids: Optional[np.ndarray]
+    voter_geoids: Optional[np.ndarray]
+
+
+class RatingLookup:
+    """
+    An in-memory copy of the cenblock_ratings table (and optionally the
+    ohvfid to blockgeoid mapping from the voters table) held in sorted
+    NumPy arrays, for looking up census block ratings by binary search
+    without a trip to SQLite. If a census block has been rated more than
+    once, its most recent rating is used.
+
+    The lookup reloads itself when vanguard.apply.cenblocks writes new
+    ratings, checking at most once every reload_interval seconds.
+
+    Args:
+        db (Path, optional): The SQLite database to load from. Defaults
+            to None, which means the simulated database.
+        with_voters (bool): If True, the voters' blockgeoids are loaded
+            too, so ratings can be looked up by ohvfid. Default is False.
+        reload_interval (float, optional): How often, in seconds, to
+            check for new ratings. Default is 1. Pass None to disable
+            reloading.
+        preload (bool): If False, nothing is loaded until load is
+            called. Default is True.
+    """
+
+    def __init__(
+        self,
+        db: Path = None,
+        with_voters: bool = False,
+        reload_interval: Optional[float] = 1.0,
+        preload: bool = True,
+    ):
+        self.db = db or constants.SIMDB
+        self.with_voters = with_voters
+        self.reload_interval = reload_interval
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._arrays = None
+        if preload:
+            self.load()
+
+    @staticmethod
+    def _version_of() -> Optional[int]:
+        p = constants.RATINGS_VERSION
+        return p.stat().st_mtime_ns if p.exists() else None
+
+    def load(self) -> None:
+        """
+        (Re)loads the ratings, and voters if with_voters is True, from
+        the database.
+        """
+        version = self._version_of()
+        conn = sqlite3.connect(f"file:{self.db}?mode=ro", uri=True)
+        try:
+            r = conn.execute(
+                "SELECT blockgeoid, rating FROM cenblock_ratings "
+                "WHERE blockgeoid IS NOT NULL ORDER BY id"
+            ).fetchall()
+            geoids = np.array([x[0] for x in r], dtype=np.int64)
+            ratings = np.array([x[1] for x in r], dtype=np.float64)
+            # Keep the last rating of each block: np.unique returns the
+            # first occurrence, so search the reversed arrays.
+            geoids, idx = np.unique(geoids[::-1], return_index=True)
+            ratings = ratings[::-1][idx]
+            ohvfids = voter_geoids = None
+            if self.with_voters:
+                r = conn.execute(
+                    "SELECT ohvfid, blockgeoid FROM voters "
+                    "WHERE ohvfid IS NOT NULL AND blockgeoid IS NOT NULL"
+                ).fetchall()
+                ohvfids = np.array([x[0] for x in r], dtype=str)
+                voter_geoids = np.array([x[1] for x in r], dtype=np.int64)
+                order = np.argsort(ohvfids, kind="stable")
+                ohvfids, voter_geoids = ohvfids[order], voter_geoids[order]
+        finally:
+            conn.close()
+        self._arrays = _Arrays(geoids, ratings, ohvfids, voter_geoids)
+        self._version = version
+
+    def maybe_reload(self) -> bool:
+        """
+        Reloads the ratings if new ones have been written since they
+        were last loaded, checking at most once every reload_interval
+        seconds.
+
+        Returns:
+            bool: True if the ratings were reloaded.
+        """
+        if self.reload_interval is None:
+            return False
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = now + self.reload_interval
+            if self._version_of() == self._version:
+                return False
+            self.load()
+            return True
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._arrays.geoids)
+
+    @staticmethod
+    def _search(keys: np.ndarray, values: np.ndarray, fill, queries) -> np.ndarray:
+        queries = np.asarray(queries)
+        if keys.dtype.kind != "U":
+            queries = queries.astype(keys.dtype)
+        idx = np.searchsorted(keys, queries)
+        idx = np.minimum(idx, max(len(keys) - 1, 0))
+        found = keys[idx] == queries if len(keys) else np.zeros(len(queries), bool)
+        out = np.full(len(queries), fill, dtype=values.dtype)
+        out[found] = values[idx[found]]
+        return out
+
+    def ratings(self, blockgeoids: Iterable[int]) -> np.ndarray:
+        """
+        Args:
+            blockgeoids (Iterable[int]): The census blocks to look up.
+        Returns:
+            ndarray: The rating of each census block, or nan if it has
+                no rating.
+        """
+        self.maybe_reload()
+        a = self._arrays
+        return self._search(a.geoids, a.ratings, np.nan, blockgeoids)
+
+    def rating(self, blockgeoid: int) -> Optional[float]:
+        """
+        Args:
+            blockgeoid (int): The census block to look up.
+        Returns:
+            Optional[float]: The rating of the census block, or None if
+                it has no rating.
+        """
+        self.maybe_reload()
+        a = self._arrays
+        i = np.searchsorted(a.geoids, blockgeoid)
+        if i < len(a.geoids) and a.geoids[i] == blockgeoid:
+            return float(a.ratings[i])
+        return None
+
+    def voter_blockgeoids(self, ohvfids: Iterable[str]) -> np.ndarray:
+        """
+        Args:
+            ohvfids (Iterable[str]): The voters to look up.
+        Returns:
+            ndarray: The blockgeoid of each voter's census block, or -1
+                if the voter is unknown.
+        """
+        self.maybe_reload()
+        a = self._arrays
+        if a.ohvfids is None:
+            raise ValueError("RatingLookup was created without with_voters=True.")
+        return self._search(a.ohvfids, a.voter_geoids, -1, list(ohvfids))
+
+    def voter_ratings(self, ohvfids: Iterable[str]) -> np.ndarray:
+        """
+        Args:
+            ohvfids (Iterable[str]): The voters to look up.
+        Returns:
+            ndarray: The rating of each voter's census block, or nan if
+                the voter is unknown or their census block has no rating.
+        """
+        return self.ratings(self.voter_blockgeoids(ohvfids))
+
+    def voter_rating(self, ohvfid: str) -> Optional[float]:
+        r = self.voter_ratings([ohvfid])[0]
+        return None if np.isnan(r) else float(r)
+
+    def save_snapshot(self, path: Path) -> None:
+        """
+        Saves the lookup's arrays as .npy files in the path directory,
+        so that other processes can memory-map them with from_snapshot
+        instead of loading from SQLite.
+
+        Args:
+            path (Path): The directory to save the snapshot in.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for k, v in self._arrays._asdict().items():
+            if v is not None:
+                np.save(path.joinpath(f"{k}.npy"), v)
+
+    @classmethod
+    def from_snapshot(cls, path: Path, mmap: bool = True) -> "RatingLookup":
+        """
+        Creates a RatingLookup from a snapshot made by save_snapshot.
+        Snapshots are not reloaded when new ratings are written.
+
+        Args:
+            path (Path): The directory the snapshot was saved in.
+            mmap (bool): If True, the arrays are memory-mapped rather
+                than read into memory. Default is True.
+        Returns:
+            RatingLookup: The RatingLookup.
+        """
+        path = Path(path)
+        arrays = dict()
+        for k in _Arrays._fields:
+            p = path.joinpath(f"{k}.npy")
+            arrays[k] = (
+                np.load(p, mmap_mode="r" if mmap else None) if p.exists() else None
+            )
+        lookup = cls(
+            with_voters=arrays["ohvfids"] is not None,
+            reload_interval=None,
+            preload=False,
+        )
+        lookup._arrays = _Arrays(**arrays)
+        return lookup
@@ -0,0 +1,145 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Sequence
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import constants, util as u
+from .models import Base
+
+# blockgeoids are 15 digits: state (2), county (3), tract (6), block (4).
+COUNTY_DIVISOR = 10**10
+# County FIPS codes are almost all odd, so they're run through Knuth's
+# multiplicative hash (keeping the high 16 of 32 bits) before taking the
+# modulus.
+HASH_MULT = 2654435761
+
+
+def shard_of(blockgeoid: Optional[int], n_shards: int) -> int:
+    """
+    Args:
+        blockgeoid (Optional[int]): A census block's geoid.
+        n_shards (int): The # of shards.
+    Returns:
+        int: The shard the census block (and its voters and calls)
+            belongs to. All blocks in a county share a shard, and blocks
+            without a geoid go to shard 0.
+    """
+    if blockgeoid is None:
+        return 0
+    county = int(blockgeoid) // COUNTY_DIVISOR
+    return county * HASH_MULT % 2**32 // 2**16 % n_shards
+
+
+def gen_shard_expr(n_shards: int, column: str = "blockgeoid") -> str:
+    """
+    Args:
+        n_shards (int): The # of shards.
+        column (str): The name of the blockgeoid column.
+    Returns:
+        str: A SQL expression equivalent to shard_of.
+    """
+    return (
+        f"COALESCE(CAST({column} AS INTEGER) / {COUNTY_DIVISOR} * {HASH_MULT} "
+        f"% {2 ** 32} / {2 ** 16} % {n_shards}, 0)"
+    )
+
+
+def gen_shard_source(table_name: str, shard: int, n_shards: int) -> str:
+    """
+    Args:
+        table_name (str): The name of a table with a blockgeoid column.
+        shard (int): The shard to filter to.
+        n_shards (int): The # of shards.
+    Returns:
+        str: A SQL subquery of the rows of table_name belonging to
+            shard, usable anywhere a table name is.
+    """
+    return f"(SELECT * FROM {table_name} WHERE {gen_shard_expr(n_shards)} = {shard})"
+
+
+def shard_path(shard: int) -> Path:
+    """
+    Args:
+        shard (int): The shard #.
+    Returns:
+        Path: The path to the shard's SQLite database file.
+    """
+    return constants.SHARDS.joinpath(f"datasets_{shard}.db")
+
+
+def connect_to_shard(shard: int) -> Session:
+    engine = sa.create_engine(
+        f"sqlite:///{shard_path(shard)}", connect_args=dict(check_same_thread=False)
+    )
+    return u.connect_to_sim_db(engine)
+
+
+def create_sharded_engine(
+    n_shards: int, tables: Optional[Sequence[str]] = None
+) -> Engine:
+    """
+    Creates a SQLAlchemy Engine on an in-memory database with every
+    shard ATTACHed, and a temporary view for each table that UNIONs
+    that table across all the shards. Queries against the Engine (e.g.
+    session.query(Voter)) read from every shard, as if the simulated
+    database weren't sharded. Note that SQLite can attach at most 10
+    databases by default.
+
+    Args:
+        n_shards (int): The # of shards.
+        tables (Optional[Sequence[str]], optional): The tables to create
+            views for. Defaults to None, which means all the models'
+            tables.
+    Returns:
+        Engine: The SQLAlchemy Engine.
+    """
+    tables = tables or list(Base.metadata.tables.keys())
+    engine = sa.create_engine("sqlite://", connect_args=dict(check_same_thread=False))
+
+    @sa.event.listens_for(engine, "connect")
+    def attach(dbapi_conn, _):
+        for i in range(n_shards):
+            dbapi_conn.execute(f"ATTACH DATABASE '{shard_path(i)}' AS shard_{i}")
+        for t in tables:
+            union = " UNION ALL ".join(
+                f"SELECT * FROM shard_{i}.{t}" for i in range(n_shards)
+            )
+            dbapi_conn.execute(f"CREATE TEMP VIEW {t} AS {union}")
+
+    return engine
+
+
+def query_shards(
+    sql: str, n_shards: int, params: Optional[Sequence] = None, workers: int = None
+) -> pd.DataFrame:
+    """
+    Runs a query against every shard in parallel and concatenates the
+    results. Aggregate queries return one row per shard, so they need to
+    be re-aggregated by the caller.
+
+    Args:
+        sql (str): The SQL query to run.
+        n_shards (int): The # of shards.
+        params (Optional[Sequence], optional): Parameters for the query.
+            Defaults to None.
+        workers (int, optional): The # of shards to query at once.
+            Defaults to None, which queries them all at once.
+    Returns:
+        DataFrame: The results from all the shards, in shard order.
+    """
+
+    def run(shard):
+        conn = sqlite3.connect(f"file:{shard_path(shard)}?mode=ro", uri=True)
+        try:
+            return pd.read_sql(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers or n_shards) as pool:
+        dfs = list(pool.map(run, range(n_shards)))
+    return pd.concat(dfs, ignore_index=True)
@@ -1,10 +1,12 @@
 import os
+from typing import List
 
 import sqlalchemy as sa
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, Session, Query, aliased
 from sqlalchemy.engine import Engine
 
 from . import constants
+from .models import Voter, EncodedVoter, VoterDonations
 
 
 def connect_to_sim_db(engine: Engine = None) -> Session:
@@ -18,3 +20,83 @@ def connect_to_sim_db(engine: Engine = None) -> Session:
 
 def print_bar():
     print("=" * os.get_terminal_size()[0])
+
+
+def touch_ratings_version():
+    """
+    Marks the census block ratings as changed, so that any RatingLookup
+    watching them reloads.
+    """
+    constants.RATINGS_VERSION.parent.mkdir(parents=True, exist_ok=True)
+    constants.RATINGS_VERSION.touch()
+
+
+def gen_voters_view() -> str:
+    """
+    Generates the statement that creates the voters view used in
+    normalized storage mode, which decodes voters_encoded back into the
+    columns of the voters table so existing readers are unaffected.
+
+    Returns:
+        str: A SQL create view statement as a str.
+    """
+    cols = []
+    joins = []
+    donation_cols = VoterDonations.gen_column_list()
+    for c in Voter.gen_column_list():
+        if c in EncodedVoter.code_columns:
+            model, code = EncodedVoter.code_columns[c]
+            t = model.__tablename__
+            cols.append(f"{t}.value AS {c}")
+            joins.append(f"LEFT JOIN {t} ON {t}.code = v.{code}")
+        elif c in donation_cols:
+            cols.append(f"d.{c}")
+        else:
+            cols.append(f"v.{c}")
+    # SQLite drops these LEFT JOINs from a plain SELECT on the view that
+    # doesn't use the joined columns, but keeps every one of them once the
+    # query aggregates (GROUP BY, MAX, etc.). Aggregate readers that only
+    # need a few columns should use query_voters instead.
+    joins.append("LEFT JOIN voter_donations d ON d.voter_id = v.id")
+    return (
+        f"CREATE VIEW {Voter.__tablename__} AS SELECT {', '.join(cols)} "
+        f"FROM {EncodedVoter.__tablename__} v {' '.join(joins)};"
+    )
+
+
+def query_voters(session: Session, *columns: str) -> Query:
+    """
+    Builds a query for decoded voter data from normalized storage,
+    joining only the lookup tables (and the voter_donations side table)
+    that the requested columns need.
+
+    Args:
+        session (Session): A SQLAlchemy Session object.
+        *columns (str): The names of the Voter columns to select.
+            Defaults to all of them.
+    Returns:
+        Query: A SQLAlchemy Query with one labeled column per requested
+            column.
+    """
+    columns: List[str] = list(columns) or Voter.gen_column_list()
+    donation_cols = VoterDonations.gen_column_list()
+    entities = []
+    joins = []
+    donations = False
+    for c in columns:
+        if c in EncodedVoter.code_columns:
+            model, code = EncodedVoter.code_columns[c]
+            a = aliased(model)
+            entities.append(a.value.label(c))
+            joins.append((a, a.code == getattr(EncodedVoter, code)))
+        elif c in donation_cols:
+            entities.append(getattr(VoterDonations, c).label(c))
+            donations = True
+        else:
+            entities.append(getattr(EncodedVoter, c).label(c))
+    q = session.query(*entities).select_from(EncodedVoter)
+    for a, on in joins:
+        q = q.outerjoin(a, on)
+    if donations:
+        q = q.outerjoin(VoterDonations, VoterDonations.voter_id == EncodedVoter.id)
+    return q
@@ -1,12 +1,15 @@
 import math
 import time
 import json
+from typing import Iterator, List, Optional
 
-from kafka import KafkaProducer
+import numpy as np
+import pandas as pd
 from sqlalchemy.orm import Session
 
-from .db.models import Call
+from .db.models import Call, Voter
 from .db import util as u
+from . import simulate
 
 
 def call_stream_generator(db: Session, batch_size: int = 10000):
@@ -21,6 +24,8 @@ def call_stream_generator(db: Session, batch_size: int = 10000):
 
 
 def stream_calls(db: Session, batch_size: int = 10000, secs_btw: int = 2):
+    from kafka import KafkaProducer
+
     producer = KafkaProducer(bootstrap_servers="kafka:9092")
     for i, call_batch in enumerate(call_stream_generator(db, batch_size), 1):
         print(f"Sending batch {i} to kafka server...")
@@ -31,6 +36,127 @@ def stream_calls(db: Session, batch_size: int = 10000, secs_btw: int = 2):
         time.sleep(secs_btw)
 
 
+def voter_batches(
+    db: Session,
+    columns: List[str],
+    batch_size: int = 10000,
+    num_samples: Optional[int] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads voters in batches, in id order. Each batch picks up after the
+    last id of the one before, so ids don't need to be contiguous.
+
+    Args:
+        db (Session): A SQLAlchemy Session object.
+        columns (List[str]): The voters columns to read.
+        batch_size (int): The # of voters in each batch.
+        num_samples (Optional[int], optional): The maximum # of voters
+            to read. Defaults to None, which reads them all.
+    Yields:
+        DataFrame: Each batch of voters.
+    """
+    cols = [getattr(Voter, c) for c in columns]
+    last_id = 0
+    n = 0
+    while num_samples is None or n < num_samples:
+        limit = batch_size if num_samples is None else min(batch_size, num_samples - n)
+        rows = (
+            db.query(Voter.id, *cols)
+            .filter(Voter.id > last_id)
+            .order_by(Voter.id)
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        n += len(rows)
+        yield pd.DataFrame([r[1:] for r in rows], columns=columns)
+
+
+def simulated_call_generator(
+    db: Session,
+    batch_size: int = 10000,
+    pos_resp_rate: float = 0.1,
+    num_samples: Optional[int] = None,
+    seed: Optional[int] = None,
+    use_ratings: bool = False,
+    donor_lift: float = 1.0,
+) -> Iterator[List[dict]]:
+    """
+    Simulates a call to each voter, drawing call results on the fly
+    the same way as gen_db.lib.gen_call_data, rather than reading them
+    from the calls table.
+
+    Args:
+        db (Session): A SQLAlchemy Session object.
+        batch_size (int): The # of calls in each batch.
+        pos_resp_rate (float): The overall positive response rate to
+            simulate.
+        num_samples (Optional[int], optional): The maximum # of calls to
+            simulate. Defaults to None, which means one per voter.
+        seed (Optional[int], optional): A seed, to make the calls
+            reproducible. Defaults to None.
+        use_ratings (bool): See gen_db.lib.gen_call_data.
+        donor_lift (float): See vanguard.simulate.response_probabilities.
+    Yields:
+        List[dict]: Each batch of calls, as dicts with ohvfid and
+            call_result keys.
+    """
+    rng = np.random.default_rng(seed)
+    ratings = simulate.load_block_ratings(db) if use_ratings else None
+    columns = simulate.voter_columns(use_ratings)
+    for df in voter_batches(db, columns, batch_size, num_samples):
+        results = simulate.simulate_calls(rng, df, pos_resp_rate, ratings, donor_lift)
+        yield [
+            dict(ohvfid=o, call_result=int(r))
+            for o, r in zip(df["ohvfid"].tolist(), results)
+        ]
+
+
+def stream_simulated_calls(
+    db: Session,
+    batch_size: int = 10000,
+    secs_btw: float = 2,
+    persist: bool = False,
+    producer=None,
+    **kwargs,
+) -> int:
+    """
+    Streams simulated calls straight to the kafka server, without
+    generating the calls table first.
+
+    Args:
+        db (Session): A SQLAlchemy Session object.
+        batch_size (int): The # of calls to send at a time.
+        secs_btw (float): The # of seconds to wait between batches.
+        persist (bool): If True, the calls are also added to the calls
+            table as they are sent. Default is False.
+        producer (KafkaProducer, optional): The producer to send calls
+            with. Defaults to None, which connects to kafka:9092.
+        **kwargs: Passed to simulated_call_generator.
+    Returns:
+        int: The # of calls sent.
+    """
+    if producer is None:
+        from kafka import KafkaProducer
+
+        producer = KafkaProducer(bootstrap_servers="kafka:9092")
+    sent = 0
+    batches = simulated_call_generator(db, batch_size, **kwargs)
+    for i, calls in enumerate(batches, 1):
+        print(f"Sending batch {i} to kafka server...")
+        for c in calls:
+            producer.send("incoming_calls", json.dumps(c).encode("utf-8"))
+        if persist:
+            db.bulk_insert_mappings(Call, calls)
+            db.commit()
+        sent += len(calls)
+        time.sleep(secs_btw)
+    producer.flush()
+    return sent
+
+
 if __name__ == "__main__":
     db = u.connect_to_sim_db()
     stream_calls(db)
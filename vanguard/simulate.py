@@ -0,0 +1,126 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .db.models import CenblockRating
+
+
+def response_probabilities(
+    df: pd.DataFrame, pos_resp_rate: float = 0.1, donor_lift: float = 1.0
+) -> np.ndarray:
+    """
+    Derives a per-voter probability of a positive call response from
+    the voter's census block rating and donor status, scaled so that the
+    average probability is pos_resp_rate.
+
+    Args:
+        df (DataFrame): A DataFrame of voters with an is_donor column and
+            optionally a rating column. Voters without a rating are
+            treated as having the average rating.
+        pos_resp_rate (float): The overall positive response rate to
+            simulate. Defaults to 0.1.
+        donor_lift (float): How much more likely donors are to respond
+            positively than non-donors in the same census block, e.g.
+            1.0 means twice as likely. Defaults to 1.0.
+    Returns:
+        ndarray: An array of probabilities, one per row of df.
+    """
+    score = np.ones(len(df))
+    if "rating" in df.columns:
+        rating = df["rating"].to_numpy(dtype=float)
+        if not np.isnan(rating).all():
+            rating = np.where(np.isnan(rating), np.nanmean(rating), rating)
+            score = np.clip(rating, 0, None)
+    if "is_donor" in df.columns:
+        score = score * (1 + donor_lift * df["is_donor"].fillna(0).to_numpy())
+    if score.sum() == 0:
+        return np.full(len(df), pos_resp_rate)
+    return np.clip(pos_resp_rate * score / score.mean(), 0, 1)
+
+
+def simulate_call_results(
+    rng: np.random.Generator,
+    n: int,
+    pos_resp_rate: float = 0.1,
+    probs: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Draws a batch of simulated call results.
+
+    Args:
+        rng (Generator): A NumPy random Generator. Seed it to make the
+            results reproducible.
+        n (int): The # of call results to draw.
+        pos_resp_rate (float): If probs is not passed, exactly this
+            percentage of the results will be positive. Defaults to 0.1.
+        probs (Optional[ndarray], optional): An array of n per-call
+            probabilities of a positive result, as returned by
+            response_probabilities. Defaults to None.
+    Returns:
+        ndarray: An array of n 1s (positive) and 0s (negative).
+    """
+    if probs is not None:
+        return (rng.random(n) < probs).astype(int)
+    result = np.zeros(n, dtype=int)
+    result[rng.choice(n, size=int(round(n * pos_resp_rate)), replace=False)] = 1
+    return result
+
+
+def voter_columns(use_ratings: bool = False) -> List[str]:
+    """
+    Args:
+        use_ratings (bool): Whether the calls will be simulated with
+            census block ratings.
+    Returns:
+        List[str]: The voters columns simulate_calls needs.
+    """
+    if use_ratings:
+        return ["ohvfid", "blockgeoid", "is_donor"]
+    return ["ohvfid"]
+
+
+def load_block_ratings(session: Session) -> pd.Series:
+    """
+    Args:
+        session (Session): A SQLAlchemy Session object.
+    Returns:
+        Series: The mean rating of each census block in cenblock_ratings,
+            indexed by blockgeoid.
+    """
+    q = session.query(CenblockRating.blockgeoid, CenblockRating.rating)
+    ratings = pd.read_sql(q.statement, session.bind)
+    return ratings.groupby("blockgeoid")["rating"].mean()
+
+
+def simulate_calls(
+    rng: np.random.Generator,
+    voters: pd.DataFrame,
+    pos_resp_rate: float = 0.1,
+    ratings: Optional[pd.Series] = None,
+    donor_lift: float = 1.0,
+) -> np.ndarray:
+    """
+    Simulates a call to each of a batch of voters.
+
+    Args:
+        rng (Generator): A NumPy random Generator.
+        voters (DataFrame): The voters, with the columns from
+            voter_columns.
+        pos_resp_rate (float): The overall positive response rate to
+            simulate. Defaults to 0.1.
+        ratings (Optional[Series], optional): Census block ratings, as
+            returned by load_block_ratings. If passed, voters' chances
+            of a positive response are weighted by them (see
+            response_probabilities). Defaults to None.
+        donor_lift (float): See response_probabilities. Defaults to 1.0.
+    Returns:
+        ndarray: An array of 1s (positive) and 0s (negative), one per
+            voter.
+    """
+    probs = None
+    if ratings is not None:
+        voters = voters.assign(rating=voters["blockgeoid"].map(ratings))
+        probs = response_probabilities(voters, pos_resp_rate, donor_lift)
+    return simulate_call_results(rng, len(voters), pos_resp_rate, probs)